@@ -1,40 +1,65 @@
+import bisect
+import heapq
+import itertools
+
+from backend import dlib
+from misc import Rectangle
+
 
 class Animation (object):
     """ An animation consists of a sequence of frames, each with a duration in ticks.
         Each frame is a widget, and the Animation object is itself a widget that simply
         renders as whatever the current frame is.
         The meaning of a tick is determined by whoever calls the update() method on the animation.
+        
+        The start tick of every frame is kept in a sorted list, so the current frame is found with a
+        binary search, and update() also works out the tick at which the frame will change next.
     """
     
     def __init__ (self, frames, loop=True):
-        """ frames should be a sequence of (widget, duration).
-            clock should be an object that has a get_tick() method.
+        """ frames should be a sequence of (widget, duration), or another Animation.
             If loop is True, then the Animation will reset once the last frame's duration passes.
         """
-        if len(frames) == 0:
-            raise ValueError ("at least one frame must be supplied")
-        
         self.loop = loop
         
         self._cur_frame_idx = 0
+        self._next_change = 0   #the tick at which the current frame ends, or None if it is the last one for good
         self._frames = [] #stores tuples of (start_tick, end_tick, frame). start_tick and end_tick form a half-open interval
+        self._starts = [] #the start_tick of each frame, for bisect
         self.extend(frames)
-        
-    def reset (self): 
+        if len(self._frames) == 0:
+            raise ValueError ("at least one frame must be supplied")
+        self.reset()
+    
+    def reset (self):
         self.update(0)
     
     def update (self, cur_tick):
+        """ Shows the frame for the given tick. Returns True if the current frame changed."""
+        length = self.total_length()
+        base = 0
         if self.loop:
-            cur_tick %= self.total_length()
-        
-        for idx, (start, end, frame) in enumerate(self._frames):
-            if start <= cur_tick and cur_tick < end:
-                self._cur_frame_idx = idx
-                return
+            base = cur_tick - cur_tick % length
+            cur_tick -= base
         
-        #if we got here then we've run past the end of the animation
-        self._cur_frame_idx = len(self._frames) - 1
+        #the last frame that starts at or before cur_tick. Past the end of the animation, that is the last frame
+        idx = max(bisect.bisect_right(self._starts, cur_tick) - 1, 0)
+        end = self._frames[idx][1]
+        if end <= cur_tick:
+            self._next_change = None
+        else:
+            self._next_change = base + end
         
+        changed = idx != self._cur_frame_idx
+        self._cur_frame_idx = idx
+        return changed
+    
+    def next_change (self):
+        """ Returns the tick at which the frame shown by the last update() will change,
+            or None if the animation has ended.
+        """
+        return self._next_change
+    
     def current_frame (self):
         return self._frames[self._cur_frame_idx][2]
     
@@ -44,25 +69,31 @@ class Animation (object):
         if len(self._frames) == 0:
             return 0
         return self._frames[-1][1]
-        
+    
     def extend (self, other):
+        """ Appends frames to the animation. other should be a sequence of (widget, duration), or another Animation."""
         start_tick = self.total_length()
-        for frame, duration in frames:
+        for frame, duration in other:
+            if duration <= 0:
+                raise ValueError ("frame duration must be positive")
             frame_info = (start_tick, start_tick + duration, frame)
             self._frames.append(frame_info)
+            self._starts.append(start_tick)
             start_tick += duration
-        
+    
     def __iter__ (self):
-        return iter(self.frames)
+        """ Iterates over (widget, duration) for each frame."""
+        for start, end, frame in self._frames:
+            yield frame, end - start
     
-    def width (self): return self._cur_frame.width()
-        
-    def height (self): return self._cur_frame.height()
+    def width (self): return self.current_frame().width()
     
-    def render(self, canvas, x, y): 
-        self._cur_frame.render(canvas, x, y)
-        
-        
+    def height (self): return self.current_frame().height()
+    
+    def render(self, canvas, x, y):
+        self.current_frame().render(canvas, x, y)
+
+
 class ProgramClock (object):
     """ A clock that provides the number of milliseconds elapsed since
         the program has started.
@@ -70,6 +101,116 @@ class ProgramClock (object):
     def get_tick(self):
         return dlib.sys_elapsed_milli()
 
+
+class AnimationGroup (object):
+    """ Drives any number of animations from one clock, which is read once per update.
+        
+        Each animation is started at a tick of the clock, and is shown relative to it. The group keeps a
+        priority queue of the tick at which the frame of each animation changes next, so an update only 
+        touches the animations whose frame actually changes, and costs nothing when none is due.
+        By default the clock is a ProgramClock, shared by every group.
+    """
+    
+    shared_clock = ProgramClock()
+    
+    def __init__ (self, clock=None):
+        self.clock = clock or self.shared_clock
+        self._entries = {}      #maps id(animation) to [animation, start_tick]
+        self._queue = []        #heap of (next_change, seq, entry). Entries that were removed are skipped when popped
+        self._seq = itertools.count()
+    
+    def add (self, animation, start_tick=None):
+        """ Starts an animation at start_tick, by default the current tick of the clock."""
+        if start_tick is None:
+            start_tick = self.clock.get_tick()
+        animation.reset()
+        entry = [animation, start_tick]
+        self._entries[id(animation)] = entry
+        self._schedule(entry)
+    
+    def remove (self, animation):
+        del self._entries[id(animation)]
+    
+    def __contains__ (self, animation):
+        return id(animation) in self._entries
+    
+    def __iter__ (self):
+        return (entry[0] for entry in self._entries.itervalues())
+    
+    def __len__ (self):
+        return len(self._entries)
+    
+    def _schedule (self, entry):
+        next_change = entry[0].next_change()
+        if next_change is not None:
+            heapq.heappush(self._queue, (next_change + entry[1], next(self._seq), entry))
+    
+    def _removed (self, entry):
+        return self._entries.get(id(entry[0])) is not entry
+    
+    def next_change (self):
+        """ Returns the tick at which the frame of an animation changes next, or None if they have all ended."""
+        queue = self._queue
+        while queue and self._removed(queue[0][2]):
+            heapq.heappop(queue)
+        if not queue:
+            return None
+        return queue[0][0]
+    
+    def _advance (self, entry, cur_tick):
+        """ Updates the animation of an entry that is due. Returns True if its frame changed."""
+        animation, start_tick = entry
+        return animation.update(cur_tick - start_tick)
+    
+    def update (self, cur_tick=None):
+        """ Advances the animations to cur_tick, by default the current tick of the clock.
+            Returns a list of the animations whose frame changed.
+        """
+        if cur_tick is None:
+            cur_tick = self.clock.get_tick()
+        changed = []
+        queue = self._queue
+        while queue and queue[0][0] <= cur_tick:
+            next_change, seq, entry = heapq.heappop(queue)
+            if self._removed(entry):
+                continue
+            if self._advance(entry, cur_tick):
+                changed.append(entry[0])
+            self._schedule(entry)
+        return changed
+
+
+class AnimationScheduler (AnimationGroup):
+    """ An AnimationGroup of animations placed on canvases, which redraws an animation when its frame changes.
+        
+        An update re-renders only the animations whose frame changed, and marks the cells they covered 
+        before and after as dirty on their canvas, so the next sync or flush only uploads those cells and 
+        canvas.is_dirty() stays False while nothing changes. As an animation is drawn over what is already
+        on the canvas, its frames should paint every cell of their bounds, for instance with a Fill.
+    """
+    
+    def add (self, animation, canvas, x, y, start_tick=None):
+        """ Starts an animation at start_tick, by default the current tick of the clock, and draws it
+            on canvas at x,y.
+        """
+        AnimationGroup.add(self, animation, start_tick)
+        self._entries[id(animation)].extend((canvas, x, y))
+        self._draw(self._entries[id(animation)])
+    
+    def _advance (self, entry, cur_tick):
+        animation, start_tick, canvas, x, y = entry
+        old_bounds = Rectangle(x, y, animation.width(), animation.height())
+        if not animation.update(cur_tick - start_tick):
+            return False
+        canvas.mark_dirty(old_bounds)
+        self._draw(entry)
+        return True
+    
+    def _draw (self, entry):
+        animation, start_tick, canvas, x, y = entry
+        animation.render(canvas, x, y)
+        canvas.mark_dirty(Rectangle(x, y, animation.width(), animation.height()))
+
 ## Test Code
 if __name__ == "__main__":
     pass
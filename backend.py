@@ -0,0 +1,20 @@
+""" Selects the console implementation that the rest of the library draws with.
+
+    Modules get the implementation with "from backend import dlib" and use it exactly like libtcodpy.
+    By default this is libtcodpy itself, which loads the native libtcod library and opens a window.
+    Setting the ASCII_BACKEND environment variable to "headless" before the library is imported
+    selects the headless module instead, which keeps every console in memory and needs neither.
+"""
+
+import os
+
+class BackendError (Exception): pass
+
+name = os.environ.get("ASCII_BACKEND", "libtcod")
+
+if name == "libtcod":
+    import libtcodpy as dlib
+elif name == "headless":
+    import headless as dlib
+else:
+    raise BackendError("unknown backend: '%s'"%name)
@@ -0,0 +1,679 @@
+""" Micro-benchmarks for the hot paths of the library.
+
+    Run with: python benchmarks.py [name ...]
+    The headless backend is used unless ASCII_BACKEND is already set, so no window is opened.
+"""
+
+import os
+os.environ.setdefault("ASCII_BACKEND", "headless")
+
+import random
+import sys
+import time
+
+def timed (func, *args):
+    """ Returns the best time in milliseconds of a few calls to func(*args), and the result of the last call."""
+    best = None
+    for i in range(3):
+        start = time.clock()
+        result = func(*args)
+        elapsed = (time.clock() - start) * 1000.0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def report (name, ms, extra=""):
+    print "  %-36s %10.2f ms %s" % (name, ms, extra)
+
+
+## Word wrapping
+
+def _legacy_wrap (text, max_width, nbsp=None):
+    """ The character by character wrapping generator that Text used before the regex based engine."""
+    def is_space (c):
+        if c == nbsp:
+            return False
+        return c.isspace()
+
+    def split (text):
+        if len(text) == 0:
+            return
+        is_last_space = False
+        i = 0
+        for j in range(len(text)):
+            is_space_ = is_space(text[j])
+            if (is_space_ and not is_last_space) or text[j] == "\n":
+                yield text[i:j]
+                i = j
+            is_last_space = is_space_
+        yield text[i:]
+
+    lines = []
+    line = ""
+    for chunk in split(text):
+        if len(chunk) > 0 and chunk[0] == "\n":
+            lines.append(line)
+            line = chunk.lstrip()
+        elif len(line) + len(chunk) > max_width:
+            lines.append(line)
+            line = chunk.lstrip()
+        else:
+            line += chunk
+        while len(line) > max_width:
+            lines.append(line[:max_width])
+            line = line[max_width:]
+    if len(line) > 0:
+        lines.append(line)
+    return lines
+
+def _make_document (size):
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do",
+             "eiusmod", "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua", "a"]
+    rand = random.Random(1)
+    parts = []
+    length = 0
+    while length < size:
+        par = " ".join(rand.choice(words) for i in range(rand.randint(5, 200)))
+        parts.append(par)
+        length += len(par) + 1
+    return "\n".join(parts)
+
+def bench_wrap ():
+    from textwidgets import Text
+
+    print "word wrap"
+    for size in (10000, 1000000, 4000000):
+        doc = _make_document(size)
+        text = Text("", 60)
+
+        def wrap_all ():
+            lines = []
+            for i, par in enumerate(doc.split("\n")):
+                lines.extend(text._wrap_paragraph(par, i == 0))
+            return lines
+
+        new_ms, new_lines = timed(wrap_all)
+        report("Text._wrap_paragraph, %d chars" % len(doc), new_ms, "(%d lines)" % len(new_lines))
+        if size <= 1000000:
+            old_ms, old_lines = timed(_legacy_wrap, doc, 60)
+            report("legacy generator, %d chars" % len(doc), old_ms, "(%.1fx)" % (old_ms / new_ms))
+            assert old_lines == new_lines, "wrapping engines disagree"
+
+        ms, widget = timed(Text, doc, 60)
+        report("Text(), %d chars" % len(doc), ms)
+
+
+## Cached decorator
+
+def bench_cached ():
+    import colour
+    import console
+    from decorators import Border, Cached, Fill, Padding
+    from lines import double_line
+    from textwidgets import Text
+
+    print "cached panel, 100 frames"
+    for buffered in (False, True):
+        console.init(80, 50, "benchmark", buffered=buffered)
+        root = console.canvas()
+        for cached in (False, True):
+            panel = (Text(_make_document(1500), 60) >> Padding(hpad=1) >> Border(double_line) 
+                     >> Fill(bg_colour=colour.darker_blue))
+            if cached:
+                panel = panel >> Cached()
+
+            def frames ():
+                for i in range(100):
+                    panel.render(root, 2, 2)
+                    console.flush()
+
+            ms, result = timed(frames)
+            report("%s, %s root" % ("Cached" if cached else "uncached", "buffered" if buffered else "native"), ms)
+
+
+## Line painting
+
+def bench_lines ():
+    from canvas import Canvas
+    from lines import LinePainter, single_line
+    from misc import Rectangle
+
+    print "line painting"
+    for n in (50, 500):
+        painter = LinePainter(single_line)
+        for i in range(n):
+            painter.add("hline", 0, i * 2, n * 2)
+            painter.add("vline", i * 2, 0, n * 2)
+        canvas = Canvas(n * 2, n * 2, buffered=True)
+
+        ms, crossings = timed(painter._crossings)
+        report("junctions of a %dx%d grid" % (n, n), ms, "(%d junctions)" % len(crossings))
+        ms, result = timed(painter.paint, canvas)
+        report("paint a %dx%d grid" % (n, n), ms)
+        ms, result = timed(lambda: [painter.get_lines(i, i) for i in range(1000)])
+        report("1000 point queries, %d lines" % len(painter), ms)
+
+
+## Colour parsing
+
+def _legacy_from_str (s):
+    """ The exception driven chain that colour.from_str used before the compiled parser."""
+    import colour
+    for parse in (colour.from_csv, colour.from_hex, colour.from_name):
+        try:
+            return parse(s)
+        except Exception:
+            pass
+    raise colour.ColourFormatError("'%s' is not a recognized colour string"%s)
+
+def bench_colour ():
+    import colour
+
+    print "colour strings, 10000 parses"
+    specs = ["red", "dark_amber", "#FF00CC", "30,120,30", "#1E,#78,#1E", "not_a_colour"]
+    for spec in specs:
+        def legacy ():
+            for i in xrange(10000):
+                try:
+                    _legacy_from_str(spec)
+                except colour.ColourFormatError:
+                    pass
+
+        def parse ():
+            for i in xrange(10000):
+                colour.parse(spec)
+
+        old_ms, result = timed(legacy)
+        new_ms, result = timed(parse)
+        report("%-14s legacy chain" % spec, old_ms)
+        report("%-14s colour.parse" % spec, new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+    distinct = ["%d,%d,%d" % (i % 256, i / 256 % 256, 7) for i in range(20000)]
+    ms, result = timed(lambda: [colour.parse(spec) for spec in distinct])
+    report("20000 distinct csv strings", ms)
+
+
+## Colour arrays
+
+def bench_colourmap ():
+    try:
+        import numpy
+    except ImportError:
+        print "colour arrays: skipped, NumPy is not installed"
+        return
+    import colour
+    import colourmap
+    import console
+
+    print "lighting overlay on 80x50, 20 frames"
+    ys, xs = numpy.mgrid[0:50, 0:80]
+    light = numpy.clip(1.0 - numpy.hypot(xs - 40, ys - 25) / 30.0, 0, 1)
+    ground = colourmap.full(80, 50, colour.dark_sepia)
+    for buffered in (False, True):
+        console.init(80, 50, "benchmark", buffered=buffered)
+        root = console.canvas()
+
+        def per_cell ():
+            for frame in range(20):
+                for y in range(50):
+                    for x in range(80):
+                        root.set_cell(x, y, bg=colour.dark_sepia * float(light[y, x]))
+                console.flush()
+
+        def vectorized ():
+            for frame in range(20):
+                root.fill_background(colourmap.scale(ground, light))
+                console.flush()
+
+        kind = "buffered" if buffered else "native"
+        old_ms, result = timed(per_cell)
+        new_ms, result = timed(vectorized)
+        report("set_cell per cell, %s" % kind, old_ms)
+        report("colourmap + fill_background, %s" % kind, new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+
+## Syncing buffered canvases
+
+def bench_sync ():
+    from canvas import Canvas
+    from misc import Rectangle
+
+    print "syncing a buffered 200x120 canvas after writing n cells, 20 syncs, %s backend (threshold %.1f%%)" % (
+        os.environ["ASCII_BACKEND"], Canvas.PARTIAL_SYNC_RATIO * 100)
+    canvas = Canvas(200, 120, buffered=True)
+
+    def sync (cells, ratio):
+        canvas.PARTIAL_SYNC_RATIO = ratio
+        for i in range(20):
+            canvas.mark_dirty(Rectangle(0, 0, 200, cells // 200))
+            canvas.mark_dirty(Rectangle(0, cells // 200, cells % 200, 1))
+            canvas.sync()
+        del canvas.PARTIAL_SYNC_RATIO
+
+    for cells in (10, 25, 50, 120, 600, 6000):
+        old_ms, result = timed(sync, cells, 1.0)
+        new_ms, result = timed(sync, cells, 0.0)
+        report("%d cells (%.2f%%), cell by cell" % (cells, cells / 240.0), old_ms)
+        report("%d cells (%.2f%%), bulk fills" % (cells, cells / 240.0), new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+
+## Cell plane views
+
+def bench_planes ():
+    from canvas import Canvas
+    from misc import Rectangle
+
+    print "cell planes of an 80x50 canvas"
+    canvas = Canvas(80, 50, buffered=True)
+    canvas.printstr(0, 0, _make_document(4000))
+
+    def per_cell ():
+        return [canvas.get_char(x, y) for y in range(50) for x in range(80)]
+
+    def views ():
+        ch, fg, bg = canvas.planes()
+        return [chr(c) for c in ch.ravel()] if hasattr(ch, "ravel") else [chr(c) for c in ch]
+
+    old_ms, old_chars = timed(per_cell)
+    new_ms, new_chars = timed(views)
+    assert old_chars == new_chars, "plane views disagree with get_char"
+    report("read chars with get_char", old_ms)
+    report("read chars through planes()", new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+    def full_syncs ():
+        for i in range(100):
+            canvas.mark_dirty(Rectangle(0, 0, 80, 50))
+            canvas.sync()
+
+    ms, result = timed(full_syncs)
+    report("100 full syncs", ms)
+
+
+## Display lists
+
+def _count_calls (module):
+    """ Wraps the console functions of a backend module to count calls, returns the dict of counts."""
+    counts = {}
+    def wrap (name, func):
+        def counted (*args):
+            counts[name] = counts.get(name, 0) + 1
+            return func(*args)
+        return counted
+    for name in dir(module):
+        if name.startswith("console_") and callable(getattr(module, name)):
+            setattr(module, name, wrap(name, getattr(module, name)))
+    return counts
+
+def bench_displaylist ():
+    import colour
+    import console
+    from backend import dlib
+    from decorators import Border, Fill, Padding
+    from displaylist import DisplayList
+    from lines import single_line
+    from textwidgets import Text
+
+    print "8 overlapping panels on an unbuffered 80x50 root, 20 frames, %s backend" % os.environ["ASCII_BACKEND"]
+    print "  (each console call is a native call with the libtcod backend, and Python with the headless one)"
+    console.init(80, 50, "benchmark")
+    root = console.canvas()
+    panels = [Text(_make_document(600), 40) >> Padding(hpad=1) >> Border(single_line) 
+              >> Fill(bg_colour=colour.Colour(20 * i, 40, 90)) for i in range(8)]
+
+    def direct ():
+        for frame in range(20):
+            for i, panel in enumerate(panels):
+                panel.render(root, i * 4, i * 2)
+            console.flush()
+
+    def replayed ():
+        for frame in range(20):
+            commands = DisplayList(80, 50)
+            for i, panel in enumerate(panels):
+                panel.render(commands, i * 4, i * 2)
+            commands.replay(root)
+            console.flush()
+
+    counts = _count_calls(dlib)
+    for name, frames in (("direct render", direct), ("DisplayList replay", replayed)):
+        counts.clear()
+        frames()
+        calls = sum(counts.itervalues()) / 20
+        ms, result = timed(frames)
+        report(name, ms, "(%d console calls per frame)" % calls)
+
+
+## Occlusion culling
+
+def bench_occlusion ():
+    import colour
+    import console
+    from backend import dlib
+    from decorators import Border, Fill, Padding
+    from layouts import AbsoluteLayout
+    from lines import single_line
+    from shapes import RectangleShape
+    from textwidgets import Text
+
+    print "background and 6 stacked panels on an 80x50 root (4000 cells), 20 frames"
+    for buffered in (False, True):
+        console.init(80, 50, "benchmark", buffered=buffered)
+        root = console.canvas()
+        background = RectangleShape(80, 50, char="/", bg_colour=colour.darkest_red)
+        panels = [Text(_make_document(1500), 50) >> Padding(hpad=1) >> Border(single_line) 
+                  >> Fill(bg_colour=colour.Colour(20 * i, 40, 90)) for i in range(6)]
+        layout = AbsoluteLayout()
+        layout.add(background, 0, 0, zlevel=-1)
+        for i, panel in enumerate(panels):
+            layout.add(panel, i * 5, i * 3)
+
+        def painter ():
+            for frame in range(20):
+                background.render(root, 0, 0)
+                for i, panel in enumerate(panels):
+                    panel.render(root, i * 5, i * 3)
+                console.flush()
+
+        def culled ():
+            for frame in range(20):
+                layout.render(root, 0, 0)
+                console.flush()
+
+        kind = "buffered" if buffered else "native"
+        old_ms, result = timed(painter)
+        new_ms, result = timed(culled)
+        old_cells, new_cells = _cells_written(painter), _cells_written(culled)
+        report("drawn back to front, %s" % kind, old_ms, "(%d cells written per frame)" % old_cells)
+        report("AbsoluteLayout, %s" % kind, new_ms, "(%.1fx, %d cells written per frame)" % (old_ms / new_ms, new_cells))
+
+def _cells_written (frames):
+    """ Returns the number of cells written per frame by frames(), which draws 20 frames, overdraw included."""
+    from profiler import Profiler
+    profiler = Profiler()
+    profiler.enable()
+    profiler.begin_frame()
+    try:
+        frames()
+    finally:
+        profiler.end_frame()
+        profiler.disable()
+    return profiler.frames[-1].cells / 20
+
+
+## Clipping
+
+def bench_clip ():
+    from canvas import Canvas, CanvasState
+    from decorators import Anchor
+    from misc import Rectangle
+    from textwidgets import Label, Text
+
+    print "scrolling a long document through a 60x20 window, 50 frames"
+    text = Text(_make_document(200000), 60)
+    canvas = Canvas(80, 50, buffered=True)
+    window = Rectangle(10, 10, 60, 20)
+
+    def every_line ():
+        #how Text drew before it was clipped: an Anchor and a print for every line
+        for frame in range(50):
+            with CanvasState(canvas, clip=window):
+                anchor = Anchor(halign="left", valign="top", min_width=text.max_width)
+                with CanvasState(canvas, 10, 10 - frame * 7):
+                    for i, (line, runs) in enumerate(text._lines):
+                        (Label(line) >> anchor).render(canvas, 0, i)
+
+    def visible_lines ():
+        for frame in range(50):
+            with CanvasState(canvas, clip=window):
+                text.render(canvas, 10, 10 - frame * 7)
+
+    old_ms, result = timed(every_line)
+    new_ms, result = timed(visible_lines)
+    report("every line, %d lines" % text.height(), old_ms)
+    report("visible lines only", new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+
+## Viewports
+
+def bench_viewport ():
+    from canvas import Canvas
+    from shapes import CellArray
+    from viewport import Viewport, VirtualViewport
+
+    print "a 1000x500 world through an 80x50 view, scrolled 200 cells to the right"
+    world = CellArray(1000, 500, [random.choice(" .,#~^") for i in range(1000 * 500)])
+    target = Canvas(80, 50, buffered=True)
+
+    def scroll (viewport):
+        for frame in range(200):
+            viewport.render(target, 0, 0)
+            viewport.scroll_right()
+
+    def materialized ():
+        full = Canvas(world.width(), world.height(), buffered=True)
+        world.render(full, 0, 0)
+        scroll(Viewport(full, 80, 50))
+
+    def virtual ():
+        viewport = VirtualViewport(world, 80, 50)
+        scroll(viewport)
+        return viewport.tiles_rendered
+
+    old_ms, result = timed(materialized)
+    new_ms, result = timed(virtual)
+    report("whole world canvas", old_ms)
+    report("VirtualViewport, %d tiles rendered" % result, new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+    print "following a point moving diagonally across the same world, 300 frames"
+
+    def follow (viewport):
+        for frame in range(300):
+            viewport.center_on(100 + frame, 100 + frame / 2)
+            viewport.render(target, 0, 0)
+
+    #enough tiles for the whole path, so only scrolling is measured once they are cached
+    old_ms, result = timed(follow, VirtualViewport(world, 80, 50, max_tiles=256))
+    new_ms, result = timed(follow, VirtualViewport(world, 80, 50, max_tiles=256, scroll_buffer=True))
+    report("cached tiles, whole view every frame", old_ms)
+    report("cached tiles, scroll buffer", new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+    #a native canvas has to be read back from libTCOD to be blitted to a buffered one
+    full = Canvas(world.width(), world.height())
+    world.render(full, 0, 0)
+    old_ms, result = timed(follow, Viewport(full, 80, 50))
+    new_ms, result = timed(follow, Viewport(full, 80, 50, scroll_buffer=True))
+    report("native canvas, whole view every frame", old_ms)
+    report("native canvas, scroll buffer", new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+
+## Animations
+
+def _legacy_frame (frames, cur_tick):
+    """ The linear scan that Animation.update made over its (start_tick, end_tick, frame) list."""
+    cur_tick %= frames[-1][1]
+    for idx, (start, end, frame) in enumerate(frames):
+        if start <= cur_tick and cur_tick < end:
+            return idx
+    return len(frames) - 1
+
+def bench_animation ():
+    from animation import Animation, AnimationGroup
+
+    class Clock (object):
+        tick = 0
+        def get_tick (self): return self.tick
+
+    print "5000 looping animations of 4 to 12 frames of 50 to 200 ms, updated every ms for 1 s"
+    timelines = []
+    for i in range(5000):
+        frames = [(j, random.randint(50, 200)) for j in range(random.randint(4, 12))]
+        timelines.append(frames)
+
+    def scan ():
+        tables = []
+        for frames in timelines:
+            table, start = [], 0
+            for frame, duration in frames:
+                table.append((start, start + duration, frame))
+                start += duration
+            tables.append(table)
+        for tick in range(1000):
+            for table in tables:
+                _legacy_frame(table, tick)
+
+    def group ():
+        clock = Clock()
+        animations = AnimationGroup(clock)
+        for frames in timelines:
+            animations.add(Animation(frames), 0)
+        changes = 0
+        for tick in range(1000):
+            clock.tick = tick
+            changes += len(animations.update())
+        return changes
+
+    old_ms, result = timed(scan)
+    new_ms, result = timed(group)
+    report("linear scan of every animation", old_ms)
+    report("AnimationGroup, %d frame changes" % result, new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+    import colour
+    import console
+    from animation import AnimationScheduler
+    from decorators import Fill
+    from textwidgets import Label
+
+    print "400 torches of 2 to 4 frames of 100 to 400 ms on an 80x50 root, 10 s at 60 frames per second"
+    console.init(80, 50, "benchmark", buffered=True)
+    root = console.canvas()
+    flames = [Label(ch) >> Fill(fg_colour=colour.Colour(255, 64 * i, 0), bg_colour=colour.black) 
+              for i, ch in enumerate("^*'")]
+    torches = [([(random.choice(flames), random.randint(100, 400)) for j in range(random.randint(2, 4))],
+                random.randrange(80), random.randrange(50)) for i in range(400)]
+
+    def every_frame ():
+        animations = [(Animation(frames), x, y) for frames, x, y in torches]
+        for tick in range(0, 10000, 16):
+            for animation, x, y in animations:
+                animation.update(tick)
+                animation.render(root, x, y)
+            console.flush()
+
+    def scheduled ():
+        clock = Clock()
+        scheduler = AnimationScheduler(clock)
+        for frames, x, y in torches:
+            scheduler.add(Animation(frames), root, x, y, 0)
+        flushes = 0
+        for tick in range(0, 10000, 16):
+            clock.tick = tick
+            scheduler.update()
+            if root.is_dirty():
+                console.flush()
+                flushes += 1
+        return flushes
+
+    old_ms, result = timed(every_frame)
+    new_ms, result = timed(scheduled)
+    report("update and render all every frame", old_ms)
+    report("AnimationScheduler, %d of 625 flushed" % result, new_ms, "(%.1fx)" % (old_ms / new_ms))
+
+
+## Main loop
+
+def bench_loop ():
+    import colour
+    import console
+    import keyboard
+    from backend import dlib
+    from controlloop import ControlLoop
+    from decorators import Border, Fill, Padding
+    from lines import single_line
+    from textwidgets import Text
+
+    print "an idle 80x50 screen with a text panel for 1 s of wall time, CPU time"
+    console.init(80, 50, "benchmark", buffered=True)
+    root = console.canvas()
+    panel = Text(_make_document(1500), 50) >> Padding(hpad=1) >> Border(single_line) >> Fill(bg_colour=colour.dark_blue)
+
+    def busy ():
+        #the hand-rolled loop: poll the keyboard, render and flush as fast as possible
+        frames = 0
+        end = dlib.sys_elapsed_milli() + 1000
+        while dlib.sys_elapsed_milli() < end:
+            keyboard.get_input()
+            panel.render(root, 5, 5)
+            console.flush()
+            frames += 1
+        return frames
+
+    def control_loop ():
+        loop = ControlLoop()
+        end = dlib.sys_elapsed_milli() + 1000
+        def update (loop, tick):
+            if tick >= end:
+                loop.stop()
+        loop.on_update.register(update)
+        loop.on_render.register(lambda loop, alpha: panel.render(root, 5, 5))
+        loop.run()
+        return len(loop.stats)
+
+    old_ms, result = timed(busy)
+    report("busy loop, %d frames" % result, old_ms)
+    new_ms, result = timed(control_loop)
+    report("ControlLoop, %d passes" % result, new_ms, "(%.1fx)" % (old_ms / max(new_ms, 0.01)))
+
+
+## Profiling
+
+def bench_profiler ():
+    import colour
+    import console
+    from decorators import Border, Fill, Padding
+    from lines import single_line
+    from profiler import Profiler
+    from textwidgets import Text
+
+    print "the cost of the profiler on 50 frames of a text panel on an 80x50 root"
+    console.init(80, 50, "benchmark", buffered=True)
+    root = console.canvas()
+    panel = Text(_make_document(1500), 50) >> Padding(hpad=1) >> Border(single_line) >> Fill(bg_colour=colour.dark_blue)
+    profiler = Profiler()
+
+    def frames ():
+        for frame in range(50):
+            profiler.begin_frame()
+            panel.render(root, 5, 5)
+            console.flush()
+            profiler.end_frame()
+
+    off_ms, result = timed(frames)
+    profiler.enable()
+    on_ms, result = timed(frames)
+    profiler.disable()
+    report("profiler disabled", off_ms)
+    report("profiler enabled", on_ms, "(%.0f%% overhead)" % ((on_ms / off_ms - 1) * 100))
+
+
+BENCHMARKS = [
+    ("wrap", bench_wrap),
+    ("cached", bench_cached),
+    ("lines", bench_lines),
+    ("colour", bench_colour),
+    ("colourmap", bench_colourmap),
+    ("sync", bench_sync),
+    ("planes", bench_planes),
+    ("displaylist", bench_displaylist),
+    ("occlusion", bench_occlusion),
+    ("clip", bench_clip),
+    ("viewport", bench_viewport),
+    ("animation", bench_animation),
+    ("loop", bench_loop),
+    ("profiler", bench_profiler),
+]
+
+if __name__ == "__main__":
+    names = sys.argv[1:]
+    for name, bench in BENCHMARKS:
+        if not names or name in names:
+            bench()
@@ -1,85 +1,340 @@
-import libtcodpy as dlib
-from misc import Rectangle
+import ctypes
+import weakref
+from backend import dlib
+from misc import Rectangle, Region
 from colour import Colour
+from cells import CellBuffer, cell_code
+
+try:
+    import numpy
+except ImportError:
+    numpy = None    #only needed to fill colours from arrays and for the array views of planes()
+
+#characters that console_print would not print as they are - a newline and the printf escape
+_UNPRINTABLE = (ord("\n"), ord("%"))
 
 #TODO - wrap LibTCOD background effect flags
 
+class Clipping (object):
+    """ The clip rectangle of a canvas, and the visibility tests that let widgets skip drawing what would be 
+        clipped. Shared by Canvas and displaylist.DisplayList, which provide width, height, x_offset, y_offset 
+        and clip_rect. clip_rect is a Rectangle in canvas coordinates (ignoring offsets) or None, and is saved
+        and restored by push_state() and pop_state(), so CanvasState keeps a stack of clip rectangles.
+    """
+    def clip_to(self, rect):
+        """Narrows clip_rect to rect, given relative to the current offsets."""
+        rect = Rectangle(rect.x + self.x_offset, rect.y + self.y_offset, rect.width, rect.height)
+        if self.clip_rect is not None:
+            rect = rect.intersection(self.clip_rect) or Rectangle(rect.x, rect.y, 0, 0)
+        self.clip_rect = rect
+    
+    def visible_rect(self):
+        """Returns the Rectangle of the cells that can be drawn on, relative to the current offsets, or None if 
+        there are none.
+        """
+        x1, y1, x2, y2 = self._clip(0, 0, self.width, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return Rectangle(x1 - self.x_offset, y1 - self.y_offset, x2 - x1, y2 - y1)
+    
+    def is_visible(self, x, y, w, h):
+        """Returns True if any cell of the rectangle at x,y (relative to the current offsets) can be drawn on."""
+        x1, y1, x2, y2 = self._clip(x + self.x_offset, y + self.y_offset, w, h)
+        return x1 < x2 and y1 < y2
+    
+    def _clip(self, x, y, w, h):
+        """Returns (x1, y1, x2, y2), the corners of the part of a rectangle in canvas coordinates that is inside 
+        both the canvas and clip_rect. The part is empty if x1 >= x2 or y1 >= y2.
+        """
+        x1, y1, x2, y2 = max(x, 0), max(y, 0), min(x + w, self.width), min(y + h, self.height)
+        clip = self.clip_rect
+        if clip is not None:
+            x1, y1 = max(x1, clip.x), max(y1, clip.y)
+            x2, y2 = min(x2, clip.x + clip.width), min(y2, clip.y + clip.height)
+        return x1, y1, x2, y2
+
+
 ## todo: key colour
-class Canvas (object):
+class Canvas (Clipping):
     """ 
     A canvas for drawing stuff on that can be blitted to a console.
     Provides a wrapper around libTCOD drawing functionality
+    
+    If buffered is True, drawing functions write into a CellBuffer held in Python instead of calling
+    into libTCOD for every cell. The buffer is pushed to the libTCOD console in one step by sync(),
+    which is called automatically when the canvas is blitted or the root console is flushed.
+    
+    If clip_rect is a Rectangle (in canvas coordinates, ignoring offsets), the drawing functions and blits 
+    onto this canvas leave every cell outside of it untouched, and text and fills are trimmed to it before 
+    calling into libTCOD. See Clipping.
     """
     
-    def __init__(self, w, h, handle=None):
-        if handle:
+    #a sync that re-uploads more than this fraction of a buffered canvas uploads all of it instead: the bulk
+    #fills are three calls whatever the size, against one call per cell otherwise. The value is the crossover
+    #measured with "python benchmarks.py sync" on the headless backend, where a cell uploaded on its own is a 
+    #Python call. With libTCOD it is a ctypes call and the fills run in C, so the crossover can differ; measure
+    #it with ASCII_BACKEND=libtcod and set PARTIAL_SYNC_RATIO on the class or on a canvas to change it.
+    PARTIAL_SYNC_RATIO = 0.001
+    
+    def __init__(self, w, h, handle=None, buffered=False):
+        if handle is not None:
             self._intern = handle
         else:
             self._intern = dlib.console_new(w,h)
+        self._width = w
+        self._height = h
+        self._buffer = None
+        if buffered:
+            self._buffer = CellBuffer(w,h)
+        self._planes = None     #the views returned by planes(), made on first use
+        self._planes_out = False    #whether planes() was called since the last sync, so the views may have been written
+        self._dirty = {}        #maps a row to the (x1, x2) span of that row written since the last sync
+        self.redrawn_cells = 0  #number of cells that were redrawn between the last two syncs
         self.x_offset = 0
         self.y_offset = 0
+        self.clip_rect = None
+        self._reset_style()
+    
+    def _reset_style(self):
+        #the defaults of a new libTCOD console
+        self._fg = Colour(255,255,255)
+        self._bg = Colour(0,0,0)
+        self._effect = dlib.BKGND_NONE
+        self._pushed_fg = self._pushed_bg = self._pushed_effect = None
+        self._state_stack = []
     
     @property
     def width(self):
-        return dlib.console_get_width(self._intern)
+        return self._width
 
     @property
     def height(self):
-        return dlib.console_get_height(self._intern)
+        return self._height
+    
+    @property
+    def buffered(self):
+        return self._buffer is not None
     
     def resize(self, w,h):
         """Changes the size of the canvas, copying over the contents of this canvas.
         Content outside of the new canvas bounds is clipped.
         """
         new = dlib.console_new(w,h)
-        bw = min(w, self.width)
-        bh = min(h, self.height)
-        dlib.console_blit(self._intern, 0, 0, bw, bh, new, 0, 0)    #copy contents
+        if self._buffer is not None:
+            self._buffer = self._buffer.resized(w,h)
+            self._planes = None
+        else:
+            bw = min(w, self.width)
+            bh = min(h, self.height)
+            dlib.console_blit(self._intern, 0, 0, bw, bh, new, 0, 0)    #copy contents
         dlib.console_delete(self._intern)   #dispose old console
         self._intern = new
+        if self._buffer is None:
+            self._pushed_fg = self._pushed_bg = self._pushed_effect = None  #the new console has its own defaults
+        self._width = w
+        self._height = h
+        self.mark_dirty(Rectangle(0,0,w,h))
+    
+    ## dirty regions
+    def mark_dirty(self, rect):
+        """Records that the cells in rect (in canvas coordinates, ignoring offsets) have changed."""
+        x1, x2 = max(rect.x, 0), min(rect.x + rect.width, self._width) - 1
+        if x1 > x2:
+            return
+        dirty = self._dirty
+        for y in range(max(rect.y, 0), min(rect.y + rect.height, self._height)):
+            span = dirty.get(y)
+            if span is None:
+                dirty[y] = (x1, x2)
+            elif x1 < span[0] or x2 > span[1]:
+                dirty[y] = (min(x1, span[0]), max(x2, span[1]))
+    
+    def _mark_cell(self, x, y):
+        if 0 <= x < self._width and 0 <= y < self._height:
+            span = self._dirty.get(y)
+            if span is None:
+                self._dirty[y] = (x, x)
+            elif x < span[0] or x > span[1]:
+                self._dirty[y] = (min(x, span[0]), max(x, span[1]))
+    
+    def dirty_region(self):
+        """Returns a Region covering the cells that were written since the last sync.
+        Consecutive rows with the same written span are merged into a single Rectangle. The region is never
+        simplified to its bounding box, so its area is redrawn_cells after the next sync.
+        """
+        region = Region(max_rects=None)
+        rect = None
+        for y in sorted(self._dirty):
+            x1, x2 = self._dirty[y]
+            if rect is not None and rect.y + rect.height == y and rect.x == x1 and rect.width == x2 - x1 + 1:
+                rect.height += 1
+                continue
+            if rect is not None:
+                region.add(rect)
+            rect = Rectangle(x1, y, x2 - x1 + 1, 1)
+        if rect is not None:
+            region.add(rect)
+        return region
+    
+    def is_dirty(self):
+        return len(self._dirty) > 0 or self._planes_out
+    
+    def sync(self):
+        """Pushes the cells written since the last sync to the libTCOD console, and updates redrawn_cells.
+        A buffered canvas uploads the written span of each row cell by cell when they are small, and uses the bulk fill 
+        functions otherwise. An unbuffered canvas was already drawn by libTCOD, so only the counter changes.
+        If planes() was called since the last sync, the whole canvas is pushed.
+        """
+        if self._planes_out:
+            self._planes_out = False
+            self.mark_dirty(Rectangle(0, 0, self._width, self._height))
+        dirty = self._dirty
+        self._dirty = {}
+        self.redrawn_cells = sum(x2 - x1 + 1 for x1, x2 in dirty.itervalues())
+        buf = self._buffer
+        if buf is None or self.redrawn_cells == 0:
+            return
+        
+        if self.redrawn_cells > buf.size * self.PARTIAL_SYNC_RATIO:
+            ch, fg_r, fg_g, fg_b, bg_r, bg_g, bg_b = buf.c_planes()
+            dlib.console_fill_char(self._intern, ch)
+            dlib.console_fill_foreground(self._intern, fg_r, fg_g, fg_b)
+            dlib.console_fill_background(self._intern, bg_r, bg_g, bg_b)
+            return
+        
+        fg, bg = dlib.Color(), dlib.Color()     #passed by value, so they are reused for every cell
+        for y, (x1, x2) in dirty.iteritems():
+            for x in range(x1, x2 + 1):
+                fg.r, fg.g, fg.b = buf.get_char_foreground(x,y)
+                bg.r, bg.g, bg.b = buf.get_char_background(x,y)
+                dlib.console_put_char_ex(self._intern, x, y, buf.get_char(x,y), fg, bg)
+    
+    def planes(self):
+        """Returns (ch, fg, bg): views of the character codes and colours of the cells that share memory with
+        the canvas, so reading and writing them costs no copies and no calls into libTCOD.
+        With NumPy, ch is a (height, width) int array, and fg and bg are (height, width, 3) int arrays indexed
+        like the colour arrays of colourmap. Without NumPy they are flat ctypes int arrays laid out like the
+        planes of a CellBuffer: ch has one value per cell, and fg and bg have the red, green and blue values of
+        every cell one after the other.
+        
+        Writes through the views are not tracked cell by cell: the next sync() after a call of planes() pushes
+        the whole canvas. Call planes() again for every batch of writes rather than keeping the views around; it
+        returns the same views each time. An unbuffered canvas becomes buffered the first time this is called,
+        reading its cells back from libTCOD once. The views are valid until the canvas is resized.
+        """
+        if self._planes is None:
+            if self._buffer is None:
+                self._buffer = self._read_cells(0, 0, self._width, self._height)
+                self._pushed_fg = self._pushed_bg = self._pushed_effect = None  #push the defaults to the buffer
+            buf = self._buffer
+            if numpy is not None:
+                shape = (3, self._height, self._width)
+                self._planes = (numpy.frombuffer(buf.ch, dtype=numpy.intc).reshape(shape[1:]),
+                                numpy.frombuffer(buf.fg, dtype=numpy.intc).reshape(shape).transpose(1, 2, 0),
+                                numpy.frombuffer(buf.bg, dtype=numpy.intc).reshape(shape).transpose(1, 2, 0))
+            else:
+                n = buf.size
+                self._planes = ((ctypes.c_int * n).from_buffer(buf.ch),
+                                (ctypes.c_int * (3*n)).from_buffer(buf.fg),
+                                (ctypes.c_int * (3*n)).from_buffer(buf.bg))
+        self._planes_out = True
+        return self._planes
+    
+    def _read_cells(self, x, y, w, h):
+        """Copies an area of the canvas into a new CellBuffer. An unbuffered canvas is read from libTCOD 
+        one cell at a time.
+        """
+        cells = CellBuffer(w,h)
+        if self._buffer is not None:
+            self._buffer.blit(x, y, w, h, cells, 0, 0)
+            return cells
+        for j in range(h):
+            for i in range(w):
+                fg = dlib.console_get_char_foreground(self._intern, x+i, y+j)
+                bg = dlib.console_get_char_background(self._intern, x+i, y+j)
+                c = dlib.console_get_char(self._intern, x+i, y+j)
+                cells.put_char_ex(i, j, c, (fg.r, fg.g, fg.b), (bg.r, bg.g, bg.b))
+        return cells
     
     def __del__(self):
         dlib.console_delete(self._intern)
                
     ## style properties
+    # The default colours and background effect live in Python and are only pushed to the
+    # console (libTCOD or the CellBuffer) by _apply_style(), right before a draw call that uses them.
     @property
     def bg_colour(self):
-        return Colour(0,0,0,struct=dlib.console_get_default_background(self._intern))
+        return self._bg
     
     @bg_colour.setter
     def bg_colour(self, bg):
         if bg is None:
-            self.bg_effect = dlib.BKGND_NONE
+            self._effect = dlib.BKGND_NONE
         else:
-            if self.bg_effect == dlib.BKGND_NONE:
-                self.bg_effect = dlib.BKGND_SET
-            dlib.console_set_default_background(self._intern, bg.get_struct())
+            if self._effect == dlib.BKGND_NONE:
+                self._effect = dlib.BKGND_SET
+            self._bg = bg
         
     @property
     def fg_colour(self):
         """ The default foreground colour which is used for functions that do not explicitly ask for one.
         """
-        return Colour(0,0,0,struct=dlib.console_get_default_foreground(self._intern))
+        return self._fg
     
     @fg_colour.setter
     def fg_colour(self, fg):
-        dlib.console_set_default_foreground(self._intern, fg.get_struct())
+        self._fg = fg
        
     @property
     def bg_effect(self):
         """ The default background colour which is used for functions that do not explicitly ask for one.
         """
-        return dlib.console_get_background_flag(self._intern)
+        return self._effect
        
     @bg_effect.setter
     def bg_effect(self, effect):
         """ The default background effect which is used for functions that do not explicitly ask for one.
         """
-        return dlib.console_set_background_flag(self._intern, effect)
+        self._effect = effect
+    
+    def _apply_style(self):
+        """Pushes the default colours and background effect to the console, skipping any that are unchanged."""
+        buf = self._buffer
+        if self._fg is not self._pushed_fg:
+            if buf is not None:
+                buf.default_fg = tuple(self._fg)
+            else:
+                dlib.console_set_default_foreground(self._intern, self._fg.get_struct())
+            self._pushed_fg = self._fg
+        if self._bg is not self._pushed_bg:
+            if buf is not None:
+                buf.default_bg = tuple(self._bg)
+            else:
+                dlib.console_set_default_background(self._intern, self._bg.get_struct())
+            self._pushed_bg = self._bg
+        if self._effect != self._pushed_effect:
+            if buf is not None:
+                buf.bg_flag = self._effect
+            else:
+                dlib.console_set_background_flag(self._intern, self._effect)
+            self._pushed_effect = self._effect
+    
+    def push_state(self):
+        """Saves the style properties, offsets and clip_rect of this canvas on a stack. See CanvasState."""
+        self._state_stack.append((self._fg, self._bg, self._effect, self.x_offset, self.y_offset, self.clip_rect))
+    
+    def pop_state(self):
+        """Restores the style properties, offsets and clip_rect saved by the last push_state()."""
+        self._fg, self._bg, self._effect, self.x_offset, self.y_offset, self.clip_rect = self._state_stack.pop()
         
     ## drawing functions
     def clear(self):
-        dlib.console_clear(self._intern)
+        self.mark_dirty(Rectangle(0, 0, self._width, self._height))
+        self._apply_style()
+        if self._buffer is not None:
+            self._buffer.clear()
+        else:
+            dlib.console_clear(self._intern)
     
     def blit_to(self, target, x, y, rect=None, bg_alpha=1.0, fg_alpha=1.0):
         """Blits a rectangular area of a canvas onto another canvas.
@@ -88,11 +343,59 @@ class Canvas (object):
         be blitted. Otherwise, the entire area of the Canvas is used
         """
         if not rect: rect = Rectangle(0,0,0,0)
+        w = rect.width or self.width
+        h = rect.height or self.height
+        if not isinstance(target, Canvas):
+            target.record_blit(self, rect.x, rect.y, w, h, x, y, fg_alpha, bg_alpha)    #a DisplayList
+            return
+        x1, y1, x2, y2 = target._clip(x, y, w, h)
+        if x1 >= x2 or y1 >= y2:
+            return
+        if (x1, y1, x2 - x1, y2 - y1) != (x, y, w, h):
+            rect = Rectangle(rect.x + x1 - x, rect.y + y1 - y, x2 - x1, y2 - y1)
+            x, y, w, h = x1, y1, x2 - x1, y2 - y1
+        target.mark_dirty(Rectangle(x, y, w, h))
+        if target._buffer is not None:
+            if self._buffer is not None:
+                self._buffer.blit(rect.x, rect.y, w, h, target._buffer, x, y, fg_alpha, bg_alpha)
+            else:
+                #slow path: the source cells have to be read back from libTCOD
+                self._read_cells(rect.x, rect.y, w, h).blit(0, 0, w, h, target._buffer, x, y, fg_alpha, bg_alpha)
+            return
+        
+        self.sync()
         dlib.console_blit(self._intern, rect.x, rect.y, rect.width, rect.height, target._intern, x, y, fg_alpha, bg_alpha)
+
                
+    def fill_foreground(self, colours):
+        """ Sets the foreground colour of every cell from a (height, width, 3) colour array, see colourmap."""
+        self._fill_colours(colours, dlib.console_fill_foreground, "fg")
+    
+    def fill_background(self, colours):
+        """ Sets the background colour of every cell from a (height, width, 3) colour array, see colourmap."""
+        self._fill_colours(colours, dlib.console_fill_background, "bg")
+    
+    def _fill_colours(self, colours, console_fill, plane):
+        if colours.shape != (self._height, self._width, 3):
+            raise ValueError("expected a colour array of shape %s, got %s"%((self._height, self._width, 3), colours.shape))
+        self.mark_dirty(Rectangle(0, 0, self._width, self._height))
+        if self._buffer is not None:
+            ch, fg, bg = self.planes()
+            (fg if plane == "fg" else bg)[...] = colours
+        else:
+            channels = [numpy.ascontiguousarray(colours[..., c], dtype=numpy.intc).ravel() for c in range(3)]
+            console_fill(self._intern, *channels)
+    
     def fill_rect(self, rect, opaque=True, effect=dlib.BKGND_DEFAULT):
-        dlib.console_rect(self._intern, rect.x + self.x_offset, rect.y + self.y_offset, 
-                          rect.width, rect.height, opaque, effect)
+        x1, y1, x2, y2 = self._clip(rect.x + self.x_offset, rect.y + self.y_offset, rect.width, rect.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        self.mark_dirty(Rectangle(x1, y1, x2 - x1, y2 - y1))
+        self._apply_style()
+        if self._buffer is not None:
+            self._buffer.rect(x1, y1, x2 - x1, y2 - y1, opaque, effect)
+        else:
+            dlib.console_rect(self._intern, x1, y1, x2 - x1, y2 - y1, opaque, effect)
     
     def put_char(self, x, y, ch):
         """ Puts the specified character or tile at the x, y coordinate, offset by this Canvas' offset values.
@@ -100,85 +403,195 @@ class Canvas (object):
         """
         x += self.x_offset
         y += self.y_offset
-        dlib.console_put_char(self._intern, x, y, ch)
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return
+        if self.clip_rect is not None and not self.clip_rect.contains(x, y):
+            return
+        self._mark_cell(x, y)
+        self._apply_style()
+        if self._buffer is not None:
+            self._buffer.put_char(x, y, ch)
+        else:
+            dlib.console_put_char(self._intern, x, y, ch)
         
     def hline(self, x, y, len, ch):
-        for i in range(0, len):
-            self.put_char(x+i,y,ch)
+        self.fill(Rectangle(x, y, len, 1), ch)
             
     def vline(self, x, y, len, ch):
-        for i in range(0, len):
-            self.put_char(x,y+i,ch)
+        self.fill(Rectangle(x, y, 1, len), ch)
+    
+    def fill(self, rect, ch):
+        """ Puts the specified character or tile in every cell of rect, like put_char() on each of them.
+            None puts a blank cell. This costs a single call into libTCOD or a few array operations per row, 
+            except for characters that can not be printed as a string, which are put one cell at a time.
+        """
+        x1, y1, x2, y2 = self._clip(rect.x + self.x_offset, rect.y + self.y_offset, rect.width, rect.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        w, h = x2 - x1, y2 - y1
+        c = cell_code(ch) or ord(" ")
+        
+        self.mark_dirty(Rectangle(x1, y1, w, h))
+        self._apply_style()
+        if self._buffer is not None:
+            self._buffer.fill(x1, y1, w, h, c)
+        elif h == 1 and c == dlib.CHAR_HLINE:
+            dlib.console_hline(self._intern, x1, y1, w)
+        elif w == 1 and c == dlib.CHAR_VLINE:
+            dlib.console_vline(self._intern, x1, y1, h)
+        elif c > 8 and c < 256 and c not in _UNPRINTABLE:
+            row = chr(c) * w
+            dlib.console_print_ex(self._intern, x1, y1, dlib.BKGND_DEFAULT, dlib.LEFT, "\n".join([row] * h))
+        else:
+            for cy in range(y1, y2):
+                for cx in range(x1, x2):
+                    dlib.console_put_char(self._intern, cx, cy, c)
             
     def set_cell(self, x, y, ch=None, bg=None, fg=None, bg_effect=dlib.BKGND_DEFAULT):
         x += self.x_offset
         y += self.y_offset
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return
+        if self.clip_rect is not None and not self.clip_rect.contains(x, y):
+            return
+        self._mark_cell(x, y)
+        self._apply_style()
+        if self._buffer is not None:
+            if bg: self._buffer.set_char_background(x, y, tuple(bg), bg_effect)
+            if fg: self._buffer.set_char_foreground(x, y, tuple(fg))
+            if ch: self._buffer.set_char(x, y, ch)
+            return
         if bg: dlib.console_set_char_background(self._intern, x, y, bg.get_struct(), bg_effect)
-        if fg: dlib.console_set_char_background(self._intern, x, y, fg.get_struct())
-        if ch: dlib.console_put_char(self._intern, x, y, ch)
+        if fg: dlib.console_set_char_foreground(self._intern, x, y, fg.get_struct())
+        if ch: dlib.console_set_char(self._intern, x, y, ch)
                    
     ## text functions
     def printstr(self, x, y, s):
         x += self.x_offset
         y += self.y_offset
-        dlib.console_print(self._intern, x, y, s)
+        lines = s.split("\n")
+        if len(lines) == 1:
+            x1, y1, x2, y2 = self._clip(x, y, len(s), 1)
+            if x1 < x2 and y1 < y2:
+                self._print(x1, y1, s[x1 - x:x2 - x])
+            return
+        width = max(len(line) for line in lines)
+        if self._clip(x, y, width, len(lines)) == (x, y, x + width, y + len(lines)):
+            self._print(x, y, s)    #all of it is visible
+            return
+        for i, line in enumerate(lines):
+            x1, y1, x2, y2 = self._clip(x, y + i, len(line), 1)
+            if x1 < x2 and y1 < y2:
+                self._print(x1, y1, line[x1 - x:x2 - x])
+    
+    def _print(self, x, y, s):
+        for i, line in enumerate(s.split("\n")):
+            self.mark_dirty(Rectangle(x, y + i, len(line), 1))
+        self._apply_style()
+        if self._buffer is not None:
+            self._buffer.print_str(x, y, s)
+        else:
+            dlib.console_print(self._intern, x, y, s)
         
     ## misc
     def get_char(self, x, y):
         x += self.x_offset
         y += self.y_offset
+        if self._buffer is not None:
+            return chr(self._buffer.get_char(x,y))
         return chr(dlib.console_get_char(self._intern,x,y)) #TODO return a Tile object instead
 
 
 class CanvasState (object):
     """ Allows you to use the Canvas's properties such as bg_colour, fg_colour, text_align, 
         and automatically restores them once you are done.
+        If clip is a Rectangle, relative to the new offsets, drawing is clipped to it as well (see Clipping).
+        The state is kept on the canvas' Python-side stack, so entering and leaving a CanvasState 
+        does not call into libTCOD.
     """
     
-    def __init__(self, canvas, x_offset=0, y_offset=0, canvas_style=None):
+    def __init__(self, canvas, x_offset=0, y_offset=0, canvas_style=None, clip=None):
         self.canvas = canvas
         self.style = canvas_style
         self.x = x_offset
         self.y = y_offset
+        self.clip = clip
        
-    def _save_state(self, canvas):    
-        self.bg_colour = canvas.bg_colour
-        self.fg_colour = canvas.fg_colour
-        self.bg_effect = canvas.bg_effect
-        #self.text_align = canvas.text_align
-        self.x_offset = canvas.x_offset
-        self.y_offset = canvas.y_offset
-    
-    def _restore_state(self, canvas):
-        canvas.bg_colour = self.bg_colour
-        canvas.fg_colour = self.fg_colour
-        canvas.bg_effect = self.bg_effect
-        #canvas.text_align = self.text_align
-        canvas.x_offset = self.x_offset
-        canvas.y_offset = self.y_offset
-        
     def __enter__(self):
-        self._save_state(self.canvas)
+        self.canvas.push_state()
         self.canvas.x_offset += self.x
         self.canvas.y_offset += self.y
+        if self.clip is not None:
+            self.canvas.clip_to(self.clip)
         if self.style:
             self.style.apply(self.canvas)
         return self
         
     def __exit__(self, exc_type, exc_value, traceback):
-        self._restore_state(self.canvas)
+        self.canvas.pop_state()
         return False
         
 class CanvasStyle (dict):
     """ A container used to hold style properties of a ui object, such as a widget.
+        Widgets that hold a style are notified when it changes, see widget.LayoutNode.
     """
+    _owners = None
+    
     def __init__(self, **style_mapping):
         for prop, val in style_mapping.iteritems():
             self[prop] = val
     
+    def _add_owner(self, owner):
+        if self._owners is None:
+            self._owners = weakref.WeakSet()
+        self._owners.add(owner)
+    
+    def _changed(self):
+        if self._owners:
+            for owner in list(self._owners):
+                owner.invalidate_layout()
+    
+    def __setitem__(self, prop, val):
+        dict.__setitem__(self, prop, val)
+        self._changed()
+    
+    def __delitem__(self, prop):
+        dict.__delitem__(self, prop)
+        self._changed()
+    
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+    
+    def setdefault(self, prop, val=None):
+        result = dict.setdefault(self, prop, val)
+        self._changed()
+        return result
+    
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self._changed()
+        return result
+    
+    def popitem(self):
+        result = dict.popitem(self)
+        self._changed()
+        return result
+    
+    def clear(self):
+        dict.clear(self)
+        self._changed()
+    
     def __getattr__(self, name):
         return self.get(name, None)
     
+    def sets_background(self):
+        """Returns True if drawing with this style replaces the background colour of the cells drawn: if it has a 
+        bg_colour, and a bg_effect of BKGND_SET or none at all - in which case the canvas is assumed not to 
+        have a blending background effect.
+        """
+        return self.get("bg_colour") is not None and self.get("bg_effect", dlib.BKGND_SET) == dlib.BKGND_SET
+    
     def apply(self, canvas):
         """Applies this Widget's style properties to a canvas."""
         for prop, val in self.iteritems():
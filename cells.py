@@ -0,0 +1,363 @@
+""" Off-screen storage for console cells.
+
+    A CellBuffer holds the character, foreground colour and background colour of every cell of a
+    console in flat array.array planes. Drawing into a CellBuffer never calls into libtcod; the planes
+    are laid out so that they can be handed to console_fill_char, console_fill_foreground and
+    console_fill_background in one step.
+
+    The char plane holds one int per cell. The fg and bg planes hold three consecutive sub-planes
+    (red, then green, then blue) of one int per cell each. Cell x,y is at index y*width + x.
+    The planes are only ever written in place and never change size, so views of their memory
+    (see CellBuffer.c_planes) stay valid for the lifetime of the buffer.
+"""
+
+import array
+import ctypes
+
+# background flags and text alignments, with the same values as their libtcod counterparts
+BKGND_NONE = 0
+BKGND_SET = 1
+BKGND_MULTIPLY = 2
+BKGND_LIGHTEN = 3
+BKGND_DARKEN = 4
+BKGND_SCREEN = 5
+BKGND_COLOR_DODGE = 6
+BKGND_COLOR_BURN = 7
+BKGND_ADD = 8
+BKGND_ADDA = 9
+BKGND_BURN = 10
+BKGND_OVERLAY = 11
+BKGND_ALPH = 12
+BKGND_DEFAULT = 13
+
+LEFT = 0
+RIGHT = 1
+CENTER = 2
+
+def cell_code(c):
+    """ Returns the integer character code for c, which may be a string of length one or an integer."""
+    if c is None:
+        return 0
+    if isinstance(c, basestring):
+        return ord(c)
+    return c
+
+def _clamp(v):
+    if v < 0: return 0
+    if v > 255: return 255
+    return int(v)
+
+def blend(back, col, flag):
+    """ Returns the background colour that results from applying col over back using a libtcod background flag.
+        back and col are (r,g,b) tuples. Returns None if the background should be left unchanged.
+        The result for each flag follows the libtcod implementation of console_set_char_background.
+    """
+    mode = flag & 0xff
+    if mode == BKGND_SET:
+        return col
+    if mode == BKGND_NONE:
+        return None
+
+    alpha = (flag >> 8) / 255.0
+    result = []
+    for b, c in zip(back, col):
+        if mode == BKGND_MULTIPLY:
+            v = b * c / 255
+        elif mode == BKGND_LIGHTEN:
+            v = max(b, c)
+        elif mode == BKGND_DARKEN:
+            v = min(b, c)
+        elif mode == BKGND_SCREEN:
+            v = 255 - (255 - b) * (255 - c) / 255
+        elif mode == BKGND_COLOR_DODGE:
+            v = 255 if b == 255 else 255 * c / (255 - b)
+        elif mode == BKGND_COLOR_BURN:
+            v = 255 - (255 * (255 - b)) / c if c > 0 else 0
+        elif mode == BKGND_ADD:
+            v = b + c
+        elif mode == BKGND_ADDA:
+            v = b + alpha * c
+        elif mode == BKGND_BURN:
+            v = b + c - 255
+        elif mode == BKGND_OVERLAY:
+            v = 2 * c * b / 255 if c <= 128 else 255 - 2 * (255 - c) * (255 - b) / 255
+        elif mode == BKGND_ALPH:
+            v = b + (c - b) * alpha
+        else:
+            raise ValueError("unknown background flag: %d"%flag)
+        result.append(_clamp(v))
+    return tuple(result)
+
+def _lerp(a, b, t):
+    return tuple(_clamp(x + (y - x) * t) for x, y in zip(a, b))
+
+
+class CellBuffer (object):
+    """ A grid of console cells stored in Python arrays.
+        Provides the subset of the libtcod console drawing primitives used by Canvas, with the same
+        semantics for default colours and background flags. Coordinates outside the buffer are ignored.
+    """
+    def __init__(self, w, h):
+        self.width = w
+        self.height = h
+        self.default_fg = (255,255,255)
+        self.default_bg = (0,0,0)
+        self.bg_flag = BKGND_NONE
+        self.alignment = LEFT
+
+        n = w * h
+        self.ch = array.array('i', [ord(' ')]) * n
+        self.fg = array.array('i', [255]) * (3*n)
+        self.bg = array.array('i', [0]) * (3*n)
+        self._c_planes = None
+
+    @property
+    def size(self):
+        """ The number of cells in the buffer."""
+        return self.width * self.height
+
+    def index(self, x, y):
+        """ Returns the index of cell x,y in the planes, or None if the cell is outside the buffer."""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return None
+
+    def plane(self, data, channel):
+        """ Returns a copy of one colour channel (0-2) of the fg or bg plane as an array."""
+        n = self.size
+        return data[channel*n:(channel+1)*n]
+
+    def c_planes(self):
+        """ Returns (ch, fg_r, fg_g, fg_b, bg_r, bg_g, bg_b): ctypes int arrays of one value per cell that
+            share memory with the planes, so they can be handed to the libtcod fill functions without a copy.
+        """
+        if self._c_planes is None:
+            n = self.size
+            plane_type = ctypes.c_int * n     #the 'i' typecode of the planes is a C int
+            offsets = [k * n * self.ch.itemsize for k in range(3)]
+            self._c_planes = ((plane_type.from_buffer(self.ch),) +
+                              tuple(plane_type.from_buffer(self.fg, offset) for offset in offsets) +
+                              tuple(plane_type.from_buffer(self.bg, offset) for offset in offsets))
+        return self._c_planes
+
+    ## per-cell access
+    def _get_rgb(self, data, i):
+        n = self.size
+        return (data[i], data[i+n], data[i+2*n])
+
+    def _set_rgb(self, data, i, col):
+        n = self.size
+        data[i], data[i+n], data[i+2*n] = col
+
+    def _set_back(self, i, col, flag):
+        if flag == BKGND_DEFAULT:
+            flag = self.bg_flag
+        if flag == BKGND_SET:
+            self._set_rgb(self.bg, i, col)
+            return
+        col = blend(self._get_rgb(self.bg, i), col, flag)
+        if col is not None:
+            self._set_rgb(self.bg, i, col)
+
+    def get_char(self, x, y):
+        i = self.index(x, y)
+        if i is None: return 0
+        return self.ch[i]
+
+    def get_char_foreground(self, x, y):
+        i = self.index(x, y)
+        if i is None: return (0,0,0)
+        return self._get_rgb(self.fg, i)
+
+    def get_char_background(self, x, y):
+        i = self.index(x, y)
+        if i is None: return (0,0,0)
+        return self._get_rgb(self.bg, i)
+
+    def set_char(self, x, y, c):
+        i = self.index(x, y)
+        if i is None: return
+        self.ch[i] = cell_code(c)
+
+    def set_char_foreground(self, x, y, col):
+        i = self.index(x, y)
+        if i is None: return
+        self._set_rgb(self.fg, i, col)
+
+    def set_char_background(self, x, y, col, flag=BKGND_SET):
+        i = self.index(x, y)
+        if i is None: return
+        self._set_back(i, col, flag)
+
+    def put_char(self, x, y, c, flag=BKGND_DEFAULT):
+        """ Sets the character of a cell using the default foreground colour, and applies the default
+            background colour with the given flag.
+        """
+        i = self.index(x, y)
+        if i is None: return
+        self.ch[i] = cell_code(c)
+        self._set_rgb(self.fg, i, self.default_fg)
+        self._set_back(i, self.default_bg, flag)
+
+    def put_char_ex(self, x, y, c, fore, back):
+        i = self.index(x, y)
+        if i is None: return
+        self.ch[i] = cell_code(c)
+        self._set_rgb(self.fg, i, fore)
+        self._set_rgb(self.bg, i, back)
+
+    ## bulk drawing
+    def print_str(self, x, y, s, flag=BKGND_DEFAULT, alignment=None):
+        """ Prints a string using the default colours. Newlines start a new line below x,y.
+            libtcod colour control codes are not interpreted.
+        """
+        if alignment is None:
+            alignment = self.alignment
+        for row, line in enumerate(s.split("\n")):
+            if alignment == RIGHT:
+                cx = x - len(line) + 1
+            elif alignment == CENTER:
+                cx = x - len(line)/2
+            else:
+                cx = x
+            self.put_chars(cx, y + row, [ord(c) for c in line], flag)
+
+    def put_chars(self, x, y, codes, flag=BKGND_DEFAULT):
+        """ Puts a row of character codes from x,y to the right, like put_char() on each of them."""
+        if not 0 <= y < self.height:
+            return
+        first, last = max(x, 0), min(x + len(codes), self.width)
+        if first >= last:
+            return
+        if flag == BKGND_DEFAULT:
+            flag = self.bg_flag
+
+        n = self.size
+        run = last - first
+        start = y * self.width + first
+        self.ch[start:start+run] = array.array('i', codes[first-x:last-x])
+        for c in range(3):
+            self.fg[start+c*n:start+c*n+run] = array.array('i', [self.default_fg[c]]) * run
+        if flag == BKGND_SET:
+            for c in range(3):
+                self.bg[start+c*n:start+c*n+run] = array.array('i', [self.default_bg[c]]) * run
+        elif flag != BKGND_NONE:
+            for i in range(start, start+run):
+                self._set_back(i, self.default_bg, flag)
+
+    def fill(self, x, y, w, h, c, flag=BKGND_DEFAULT):
+        """ Sets the character of every cell in a rectangle using the default foreground colour, and applies the
+            default background colour with the given flag, like put_char() on every cell.
+        """
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+
+        n = self.size
+        run = x2 - x1
+        chars = array.array('i', [cell_code(c)]) * run
+        channels = [array.array('i', [v]) * run for v in self.default_fg]
+        for cy in range(y1, y2):
+            start = cy * self.width + x1
+            self.ch[start:start+run] = chars
+            for k in range(3):
+                self.fg[start+k*n:start+k*n+run] = channels[k]
+        self.rect(x1, y1, run, y2 - y1, False, flag)
+
+    def rect(self, x, y, w, h, clear, flag=BKGND_DEFAULT):
+        """ Applies the default background colour to a rectangle of cells.
+            If clear is True the characters in the rectangle are also erased.
+        """
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        if flag == BKGND_DEFAULT:
+            flag = self.bg_flag
+
+        n = self.size
+        run = x2 - x1
+        blank = array.array('i', [ord(' ')]) * run
+        channels = [array.array('i', [v]) * run for v in self.default_bg]
+        for cy in range(y1, y2):
+            start = cy * self.width + x1
+            if clear:
+                self.ch[start:start+run] = blank
+            if flag == BKGND_SET:
+                for c in range(3):
+                    self.bg[start+c*n:start+c*n+run] = channels[c]
+            elif flag != BKGND_NONE:
+                for i in range(start, start+run):
+                    self._set_back(i, self.default_bg, flag)
+
+    def clear(self):
+        """ Erases every cell, setting it to a space with the default colours."""
+        n = self.size
+        self.ch[:] = array.array('i', [ord(' ')]) * n
+        self.fg[:] = array.array('i', self.default_fg[0:1]*n + self.default_fg[1:2]*n + self.default_fg[2:3]*n)
+        self.bg[:] = array.array('i', self.default_bg[0:1]*n + self.default_bg[1:2]*n + self.default_bg[2:3]*n)
+
+    def blit(self, x, y, w, h, dst, xdst, ydst, ffade=1.0, bfade=1.0):
+        """ Copies a w*h area of this buffer at x,y onto the CellBuffer dst at xdst,ydst.
+            A width or height of 0 means the full width or height of this buffer.
+            The fades follow the rules of libtcod's console_blit.
+        """
+        if w == 0: w = self.width
+        if h == 0: h = self.height
+
+        #clip the copied area to both buffers
+        if x < 0: w, xdst, x = w + x, xdst - x, 0
+        if y < 0: h, ydst, y = h + y, ydst - y, 0
+        if xdst < 0: w, x, xdst = w + xdst, x - xdst, 0
+        if ydst < 0: h, y, ydst = h + ydst, y - ydst, 0
+        w = min(w, self.width - x, dst.width - xdst)
+        h = min(h, self.height - y, dst.height - ydst)
+        if w <= 0 or h <= 0:
+            return
+
+        sn, dn = self.size, dst.size
+        if ffade == 1.0 and bfade == 1.0:
+            for row in range(h):
+                s = (y + row) * self.width + x
+                d = (ydst + row) * dst.width + xdst
+                dst.ch[d:d+w] = self.ch[s:s+w]
+                for c in range(3):
+                    dst.fg[d+c*dn:d+c*dn+w] = self.fg[s+c*sn:s+c*sn+w]
+                    dst.bg[d+c*dn:d+c*dn+w] = self.bg[s+c*sn:s+c*sn+w]
+            return
+
+        for row in range(h):
+            for col in range(w):
+                s = (y + row) * self.width + x + col
+                d = (ydst + row) * dst.width + xdst + col
+                self._blend_cell(s, dst, d, ffade, bfade)
+
+    def _blend_cell(self, s, dst, d, ffade, bfade):
+        src_c, dst_c = self.ch[s], dst.ch[d]
+        src_fg, src_bg = self._get_rgb(self.fg, s), self._get_rgb(self.bg, s)
+        dst_fg, dst_bg = dst._get_rgb(dst.fg, d), dst._get_rgb(dst.bg, d)
+
+        dst._set_rgb(dst.bg, d, _lerp(dst_bg, src_bg, bfade))
+        if src_c == ord(' '):
+            dst._set_rgb(dst.fg, d, _lerp(dst_fg, src_bg, bfade))
+        elif dst_c == ord(' '):
+            dst.ch[d] = src_c
+            dst._set_rgb(dst.fg, d, _lerp(dst_bg, src_fg, ffade))
+        elif dst_c == src_c:
+            dst._set_rgb(dst.fg, d, _lerp(dst_fg, src_fg, ffade))
+        elif ffade < 0.5:
+            dst._set_rgb(dst.fg, d, _lerp(dst_fg, dst_bg, ffade*2))
+        else:
+            dst.ch[d] = src_c
+            dst._set_rgb(dst.fg, d, _lerp(dst_bg, src_fg, (ffade-0.5)*2))
+
+    def resized(self, w, h):
+        """ Returns a new CellBuffer of size w*h holding the contents of this one, clipped to the new size."""
+        new = CellBuffer(w, h)
+        new.default_fg = self.default_fg
+        new.default_bg = self.default_bg
+        new.bg_flag = self.bg_flag
+        new.alignment = self.alignment
+        self.blit(0, 0, min(w, self.width), min(h, self.height), new, 0, 0)
+        return new
@@ -4,11 +4,14 @@
         Hex strings have the form "#RRGGBB", where RR,GG,BB are hex values from 0 - 255 and are exactly 2 characters long.
         CSV strings have the form "r,g,b", where r, g, and b are either a decimal integer or a hex integer following a '#' e.g. #FF
         Name strings can be any key string from the colour_names property.
+    parse() reads any of them with one compiled regex and returns None instead of raising; from_str() raises.
     
     TODO: HSV support?
 """
 
-import libtcodpy as dlib
+import re
+
+from backend import dlib
 
 def from_hex (colour_str):
     if colour_str[0] == '#':    #remove optional '#'
@@ -40,70 +43,184 @@ def from_csv (csv_str):
     return Colour(*values)
     
 def from_str (s):
-    """ Attempts to parse a string into a Colour object. """
-    try: 
-        return from_csv(s)
-    except Exception: 
-        pass
-        
-    try: 
-        return from_hex(s)
-    except Exception: 
-        pass
+    """ Attempts to parse a string into a Colour object. Raises ColourFormatError if s is not a colour string."""
+    colour = parse(s)
+    if colour is None:
+        raise ColourFormatError("'%s' is not a recognized colour string"%s)
+    return colour
+
+_COLOUR_RE = re.compile(r"""
+    \s*(?:
+        \#?(?P<hex>[0-9A-Fa-f]{6})                                  #hex string
+      | (?P<r>\#[0-9A-Fa-f]+|\d+) \s*,\s* (?P<g>\#[0-9A-Fa-f]+|\d+) \s*,\s* (?P<b>\#[0-9A-Fa-f]+|\d+)    #csv string
+      | (?P<name>\w+)                                                #name string
+    )\s*$""", re.VERBOSE)
+
+def _csv_value (s):
+    if s[0] == '#':
+        return int(s[1:], 16)
+    return int(s)
+
+#memo of the colour strings parsed recently, in two generations: a string that is used again while in the old 
+#generation is moved to the new one, and the old generation is dropped when the new one is full. This keeps
+#the recently used strings like an LRU, but a hit is a single dict lookup.
+MAX_PARSED = 256
+_parsed = {}
+_parsed_old = {}
+_MISSING = object()
 
+def parse (s):
+    """ Parses a hex, csv or name colour string in one regex match, and returns the Colour or None if s is not
+        a colour string. Never raises, so it is suitable for hot paths such as markup parsing.
+        The results, including failures, are memoized for the most recently used strings.
+    """
+    global _parsed, _parsed_old
     try:
-        return from_name(s)
-    except Exception: 
-        pass
+        colour = _parsed.get(s, _MISSING)
+        if colour is not _MISSING:
+            return colour
+        colour = _parsed_old.get(s, _MISSING)
+    except TypeError:   #unhashable
+        return None
+    if colour is _MISSING:
+        colour = _parse(s)
+    
+    if len(_parsed) >= MAX_PARSED:
+        _parsed_old = _parsed
+        _parsed = {}
+    _parsed[s] = colour
+    return colour
 
-    raise ColourFormatError("'%s' is not a recognized colour string"%s)
+def _parse (s):
+    try:
+        match = _COLOUR_RE.match(s)
+    except TypeError:
+        return None
+    if match is None:
+        return None
+    
+    hex_digits, name = match.group("hex", "name")
+    if hex_digits is not None:
+        return Colour.from_packed(int(hex_digits, 16))
+    if name is not None:
+        return colour_names.get(name)
+    return Colour(*[_csv_value(v) for v in match.group("r", "g", "b")])
 
 class ColourFormatError (Exception): pass
        
+def _clamp (v):
+    v = int(v)
+    if v < 0: return 0
+    if v > 255: return 255
+    return v
+
 #originaly _TCODColour
 class Colour (object):
-    """ Wrapper over a LibTCOD Color object
+    """ An immutable RGB colour, stored as a packed 24-bit int 0xRRGGBB.
+        
+        Colours are interned: creating a colour with the same components as an existing one usually returns the
+        same object, so colours are cheap to create, compare and hash. The intern table is bounded, and is cleared
+        when it is full, so equal colours are not always identical - compare colours with ==, not 'is'.
+        The LibTCOD Color struct of a colour is shared through a bounded cache of structs by packed value.
     """
-    def __init__(self, r, g, b, struct=None):
-        """ r, g, b are the RGB values of the colour between 0 and 255. If struct is provided, these are ignored.
-            struct is the LibTCOD Color struct to be used for this colour.
+    __slots__ = ("_packed",)
+    
+    MAX_INTERNED = 4096     #size limit of the intern table
+    MAX_STRUCTS = 1024      #size limit of the struct cache
+    _interned = {}          #maps packed values to Colours
+    _structs = {}           #maps packed values to LibTCOD Color structs
+    
+    def __new__(cls, r, g, b, struct=None):
+        """ r, g, b are the RGB values of the colour between 0 and 255, out of range values are clamped.
+            If struct is provided, r, g, b are ignored and the values of the LibTCOD Color struct are used.
         """
-        self._intern = struct or dlib.Color(r,g,b)
+        if struct is not None:
+            r, g, b = struct.r, struct.g, struct.b
+        return cls.from_packed((_clamp(r) << 16) | (_clamp(g) << 8) | _clamp(b))
+    
+    @classmethod
+    def from_packed (cls, packed):
+        """ Returns the colour for a packed int 0xRRGGBB."""
+        if cls is not Colour:
+            colour = object.__new__(cls)
+            object.__setattr__(colour, "_packed", packed)
+            return colour
+        
+        colour = Colour._interned.get(packed)
+        if colour is None:
+            if len(Colour._interned) >= Colour.MAX_INTERNED:
+                Colour._interned.clear()
+            colour = object.__new__(cls)
+            object.__setattr__(colour, "_packed", packed)
+            Colour._interned[packed] = colour
+        return colour
+    
+    def __setattr__ (self, name, value):
+        raise AttributeError("Colour objects are immutable")
+    
+    def __reduce__ (self):
+        return (self.__class__, tuple(self))
+    
+    @property
+    def packed (self): return self._packed
+    
+    @property
+    def r (self): return self._packed >> 16
+    
+    @property
+    def g (self): return (self._packed >> 8) & 0xFF
+    
+    @property
+    def b (self): return self._packed & 0xFF
     
     def hex_str (self):
         """ Returns the hex-string representation of this colour. """
-        return "#%02X%02X%02X"%(self._intern[0],self._intern[1],self._intern[2])
+        return "#%06X"%self._packed
         
     def get_struct (self):
-        """ Returns the internal LibTCOD implementation of this colour. """
-        return self._intern
+        """ Returns a LibTCOD Color struct for this colour. The struct is shared, so it must not be modified."""
+        struct = Colour._structs.get(self._packed)
+        if struct is None:
+            if len(Colour._structs) >= Colour.MAX_STRUCTS:
+                Colour._structs.clear()
+            struct = dlib.Color(self.r, self.g, self.b)
+            Colour._structs[self._packed] = struct
+        return struct
         
     def __eq__ (self, other):
-        return self._intern == other._intern
-
+        return isinstance(other, Colour) and self._packed == other._packed
+    
+    def __ne__ (self, other):
+        return not self == other
+    
+    def __hash__ (self):
+        return self._packed
+    
+    #the arithmetic saturates like LibTCOD's colour functions
     def __add__ (self, other):
-        return Colour(*(self._intern + other._intern))
+        return Colour(min(255, self.r + other.r), min(255, self.g + other.g), min(255, self.b + other.b))
     
     def __sub__ (self, other):
-        return Colour(*(self._intern - other._intern))
+        return Colour(max(0, self.r - other.r), max(0, self.g - other.g), max(0, self.b - other.b))
     
     def __mul__ (self, other):
-        if isinstance(other, self.__class__):
-            return Colour(*(self._intern * other._intern))
+        if isinstance(other, Colour):
+            return Colour(self.r * other.r / 255, self.g * other.g / 255, self.b * other.b / 255)
         return self._scalar_mult(other)
     
     def __rmul__ (self, other):
         return self * other
         
     def _scalar_mult (self, n):
-        return Colour(0,0,0, self._intern * n)
+        return Colour(self.r * n, self.g * n, self.b * n)
         
     def __iter__(self):
         """ Produces an iterator over the components of this colour. """
-        return iter(self._intern)
+        packed = self._packed
+        return iter((packed >> 16, (packed >> 8) & 0xFF, packed & 0xFF))
     
     def __repr__(self):
-        return "%s%s"%(self.__class__.__name__, tuple(self._intern))
+        return "%s%s"%(self.__class__.__name__, tuple(self))
     
 #Not used
 class _RGBColour (object):
@@ -134,9 +251,103 @@ class _RGBColour (object):
         return "%s(%d,%d,%d)"%(self.__class__.__name__, self.r, self.g, self.b)
 
 class TextColourParser (object):
-    """ 
+    """ Parses colour markup into plain text and runs of colours.
+    
+        "<fg|text>" shows text in the colour fg, "<&bg|text>" on the background colour bg, and "<fg&bg|text>" both.
+        Colours are any colour string accepted by parse(), and markup may be nested. "\\<" and "\\>" stand for
+        literal angle brackets, a "<" that does not start valid markup is shown as it is, and so is a ">" that 
+        does not close any.
+        
+        parse(source) returns (text, runs), where runs is a tuple of (start, end, fg, bg) tuples that cover all of
+        text in order. fg or bg is None where the default colour applies, and adjacent text with the same colours
+        is a single run. The results are cached per source string, so parsing an unchanged string again is a
+        dict lookup.
     """
-    pass
+    _TOKEN_RE = re.compile(r"\\[<>]|<([^<>|]*)\||>")
+    
+    def __init__(self, max_cached=256):
+        self.max_cached = max_cached
+        self._cache = {}        #the cache is kept in two generations, like the memo of parse()
+        self._cache_old = {}
+    
+    def parse (self, source):
+        result = self._cache.get(source)
+        if result is None:
+            result = self._cache_old.get(source)
+            if result is None:
+                result = self._parse(source)
+            if len(self._cache) >= self.max_cached:
+                self._cache_old = self._cache
+                self._cache = {}
+            self._cache[source] = result
+        return result
+    
+    def tokens (self, source):
+        """ Yields the tokens of source in order: ("text", s), ("open", fg, bg) and ("close",)."""
+        depth = 0
+        pos = 0
+        for match in self._TOKEN_RE.finditer(source):
+            if match.start() > pos:
+                yield ("text", source[pos:match.start()])
+            pos = match.end()
+            
+            token = match.group()
+            if token[0] == "\\":
+                yield ("text", token[1])
+            elif token == ">":
+                if depth > 0:
+                    depth -= 1
+                    yield ("close",)
+                else:
+                    yield ("text", token)
+            else:
+                colours = self._parse_spec(match.group(1))
+                if colours is None:
+                    yield ("text", token)
+                else:
+                    depth += 1
+                    yield ("open",) + colours
+        if pos < len(source):
+            yield ("text", source[pos:])
+    
+    def _parse_spec (self, spec):
+        """ Returns (fg, bg) for a spec "fg", "&bg" or "fg&bg", or None if it is not valid."""
+        fg_str, sep, bg_str = spec.partition("&")
+        fg = parse(fg_str) if fg_str else None
+        bg = parse(bg_str) if bg_str else None
+        if (fg_str and fg is None) or (bg_str and bg is None):
+            return None
+        return (fg, bg)
+    
+    def _parse (self, source):
+        stack = []
+        fg = bg = None
+        text = []
+        runs = []
+        pos = 0
+        for token in self.tokens(source):
+            kind = token[0]
+            if kind == "text":
+                s = token[1]
+                if runs and runs[-1][2] == fg and runs[-1][3] == bg:
+                    runs[-1][1] += len(s)
+                else:
+                    runs.append([pos, pos + len(s), fg, bg])
+                text.append(s)
+                pos += len(s)
+            elif kind == "open":
+                stack.append((fg, bg))
+                fg = token[1] or fg
+                bg = token[2] or bg
+            else:
+                fg, bg = stack.pop()
+        return "".join(text), tuple(tuple(run) for run in runs)
+
+markup_parser = TextColourParser()
+
+def parse_markup (source):
+    """ Returns (text, runs) for a string with colour markup, see TextColourParser."""
+    return markup_parser.parse(source)
     
 ## Initialization
 colour_names = {}       #A dictionary that will contain the default colours
@@ -0,0 +1,108 @@
+""" Vectorized colour operations on NumPy arrays.
+
+    A colour array is a NumPy array of shape (..., 3) with dtype uint8, holding the r, g, b values of a colour
+    in its last axis. An array of shape (height, width, 3) covers a canvas, and can be written to it in one
+    call with Canvas.fill_foreground() or Canvas.fill_background().
+
+    The arithmetic saturates and truncates like the LibTCOD colour functions. Operands can be colour arrays,
+    Colours or (r, g, b) tuples, and coefficients can be numbers or arrays of coefficients with the shape of
+    the colour array without its last axis, for instance a (height, width) light map.
+
+    This module requires NumPy.
+"""
+
+import numpy
+
+def as_array (colour):
+    """ Returns a colour array for a colour array, a Colour or an (r, g, b) tuple."""
+    if isinstance(colour, numpy.ndarray):
+        return colour
+    return numpy.array(tuple(colour), dtype=numpy.uint8)
+
+def full (width, height, colour):
+    """ Returns a (height, width, 3) colour array filled with a single colour."""
+    result = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    result[...] = as_array(colour)
+    return result
+
+def _coefficients (coef):
+    """ Returns coef as a number or a float array that broadcasts over the channels of a colour array."""
+    if isinstance(coef, numpy.ndarray):
+        return coef.astype(numpy.float32)[..., numpy.newaxis]
+    return coef
+
+def _to_colours (values):
+    return numpy.clip(values, 0, 255).astype(numpy.uint8)
+
+def lerp (a, b, coef):
+    """ Returns a + (b - a) * coef for each cell."""
+    a = as_array(a).astype(numpy.float32)
+    b = as_array(b).astype(numpy.float32)
+    return _to_colours(a + (b - a) * _coefficients(coef))
+
+def scale (a, coef):
+    """ Returns a * coef for each cell."""
+    return _to_colours(as_array(a).astype(numpy.float32) * _coefficients(coef))
+
+def multiply (a, b):
+    """ Returns the product of two colours for each cell, a * b / 255."""
+    return (as_array(a).astype(numpy.uint16) * as_array(b) // 255).astype(numpy.uint8)
+
+def add (a, b):
+    """ Returns the sum of two colours for each cell."""
+    return _to_colours(as_array(a).astype(numpy.int16) + as_array(b))
+
+def subtract (a, b):
+    """ Returns the difference of two colours for each cell."""
+    return _to_colours(as_array(a).astype(numpy.int16) - as_array(b))
+
+def rgb_to_hsv (a):
+    """ Returns a float array of the same shape as the colour array a, holding hue (0-360), saturation (0-1)
+        and value (0-1) in its last axis.
+    """
+    rgb = as_array(a).astype(numpy.float32) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(-1)
+    delta = maxc - rgb.min(-1)
+
+    safe = numpy.where(delta > 0, delta, 1.0)
+    hue = numpy.where(maxc == r, (g - b) / safe,
+          numpy.where(maxc == g, 2.0 + (b - r) / safe, 4.0 + (r - g) / safe))
+    hue = numpy.where(delta > 0, (hue * 60.0) % 360.0, 0.0)
+    saturation = numpy.where(maxc > 0, delta / numpy.where(maxc > 0, maxc, 1.0), 0.0)
+    return numpy.stack([hue, saturation, maxc], axis=-1)
+
+def hsv_to_rgb (hsv):
+    """ Returns the colour array for an array of hue (0-360), saturation (0-1) and value (0-1) triples."""
+    hsv = numpy.asarray(hsv, dtype=numpy.float32)
+    h, s, v = (hsv[..., 0] % 360.0) / 60.0, hsv[..., 1], hsv[..., 2]
+    sector = numpy.floor(h).astype(numpy.int8) % 6
+    f = h - numpy.floor(h)
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+
+    r = numpy.choose(sector, [v, q, p, p, t, v])
+    g = numpy.choose(sector, [t, v, v, q, p, p])
+    b = numpy.choose(sector, [p, p, t, v, v, q])
+    return _to_colours(numpy.stack([r, g, b], axis=-1) * 255.0 + 0.5)     #rounded like TCOD_color_set_HSV
+
+def gradient (colours, indexes):
+    """ Returns a colour array of max(indexes) + 1 colours, which interpolates between the key colours placed
+        at the given increasing indexes, like libtcodpy.color_gen_map.
+    """
+    keys = numpy.array([tuple(colour) for colour in colours], dtype=numpy.float32)
+    positions = numpy.arange(max(indexes) + 1)
+    channels = [numpy.interp(positions, indexes, keys[:, c]) for c in range(3)]
+    return _to_colours(numpy.stack(channels, axis=-1))
+
+def apply_map (values, colour_map):
+    """ Returns the colour array that maps each value to a colour of colour_map, a gradient for instance.
+        Integer values are indexes into colour_map, and are clipped to its range. Float values between 0 and 1
+        are scaled to the whole map.
+    """
+    values = numpy.asarray(values)
+    last = len(colour_map) - 1
+    if values.dtype.kind == "f":
+        values = values * last
+    return colour_map[numpy.clip(values, 0, last).astype(numpy.intp)]
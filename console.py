@@ -2,15 +2,17 @@
 Wrapper for the root console in libtcod.
 """
 
-import libtcodpy as dlib
+from backend import dlib
 from canvas import Canvas
 
 class ConsoleError(Exception): pass
 
+_ROOT_HANDLE = 0   #Lib TCOD refers to the root console with a NULL console pointer
+
 class _RootCanvas(Canvas):
     """Wrapper for the root console in Lib TCOD"""
-    def __init__(self, handle):
-        Canvas.__init__(self,0,0,handle)
+    def __init__(self, w, h, buffered=False):
+        Canvas.__init__(self, w, h, _ROOT_HANDLE, buffered)
        
     def __del__ (self): 
         pass
@@ -19,10 +21,13 @@ class _RootCanvas(Canvas):
 _root = None   #the root canvas
 _title = ""
         
-def init(w, h, title):
+def init(w, h, title, buffered=False):
+    """ Creates the root console. If buffered is True, drawing on the root canvas is done in
+        Python and pushed to Lib TCOD in bulk when flush() is called.
+    """
     global _root, _title
-    handle = dlib.console_init_root(w, h, title)
-    _root = _RootCanvas(handle)
+    dlib.console_init_root(w, h, title)
+    _root = _RootCanvas(w, h, buffered)
     _title = title
               
 def width(): return dlib.console_get_width(None)
@@ -41,8 +46,17 @@ def set_fullscreen(fullscreen): dlib.console_set_fullscreen(fullscreen)
 
 def closed(): return dlib.console_is_window_closed()
 
-def flush(): dlib.console_flush()
+def flush(): 
+    if _root is not None:
+        _root.sync()
+    dlib.console_flush()
 
 def canvas(): return _root
+
+def redrawn_cells(): 
+    """Returns the number of root console cells that were redrawn by the last flush, 0 before init()."""
+    if _root is None:
+        return 0
+    return _root.redrawn_cells
         
 def wait_for_user(): dlib.console_wait_for_keypress(True)
\ No newline at end of file
@@ -0,0 +1,166 @@
+""" The main loop of an application.
+
+    The simulation is updated at a fixed rate, so it behaves the same whatever the frame rate, and the screen
+    is rendered at most max_fps times per second, and only when something asked for it. Between frames the loop
+    sleeps until the next update, animation change or input poll is due, so an idle application uses almost
+    no CPU.
+"""
+
+import collections
+import time
+
+from animation import AnimationGroup
+from backend import dlib
+from events import EventSource
+import console
+import keyboard
+
+
+class FrameStats (object):
+    """ What one pass of the control loop did. Durations are in milliseconds."""
+    def __init__ (self, tick):
+        self.tick = tick            #the tick of the clock at the start of the pass
+        self.updates = 0            #the number of fixed updates run
+        self.update_time = 0.0
+        self.rendered = False       #whether on_render was fired
+        self.render_time = 0.0      #the time taken by on_render and by the flush of the root console
+        self.flushed = False
+        self.sleep_time = 0         #the time the loop asked to sleep for after the pass
+
+    def busy_time (self):
+        return self.update_time + self.render_time
+
+
+class ControlLoop (object):
+    """ Runs an application until stop() is called or the window is closed.
+
+        Each pass of the loop:
+            - fires on_key(loop, keypress) for each key that was pressed or released
+            - fires on_update(loop, tick) once for each update_ms that passed on the clock, with the tick of
+              that update. When it falls behind by more than max_updates, the missed time is dropped.
+            - updates the animations, an AnimationScheduler, if there is one
+            - fires on_render(loop, alpha) if invalidate() was called or a key was pressed since the last render,
+              and a frame is due. Key releases do not ask for a render.
+              If max_fps is 0 or None, renders are not capped. alpha is how far the clock is between the last update and the next one,
+              from 0 to 1, for interpolating movement.
+            - flushes the root console if anything was drawn on it
+            - sleeps until the next update, the next animation change or the next input poll, whichever is first
+
+        Ticks come from clock, by default the clock of the animations or else the shared ProgramClock.
+        If profiler is a profiler.Profiler, each pass that rendered or flushed is recorded as one of its frames.
+        The stats of the last history passes are kept in stats, a deque of FrameStats.
+    """
+    def __init__ (self, update_ms=20, max_fps=60, max_updates=5, animations=None, clock=None, history=120,
+                  profiler=None):
+        if max_fps is not None and max_fps < 0:
+            raise ValueError("max_fps can not be negative, got %r"%max_fps)
+        self.update_ms = update_ms
+        self.frame_ms = 1000 // max_fps if max_fps else 0     #0 when renders are not capped
+        self._poll_ms = self.frame_ms or update_ms              #the longest the loop sleeps without polling input
+        self.max_updates = max_updates
+        self.animations = animations
+        if clock is None:
+            clock = animations.clock if animations is not None else AnimationGroup.shared_clock
+        self.clock = clock
+        self.profiler = profiler
+
+        self.on_key = EventSource()
+        self.on_update = EventSource()
+        self.on_render = EventSource()
+
+        self.stats = collections.deque(maxlen=history)
+        self._running = False
+        self._invalid = True        #whether on_render has to be fired
+        self._next_update = None    #the tick of the next fixed update
+        self._next_frame = 0        #the earliest tick of the next render
+
+    def invalidate (self):
+        """ Asks for on_render to be fired on the next frame."""
+        self._invalid = True
+
+    def stop (self):
+        self._running = False
+
+    def run (self):
+        self._running = True
+        self._next_update = self.clock.get_tick()
+        while self._running and not console.closed():
+            stats = self.step()
+            if stats.sleep_time > 0:
+                dlib.sys_sleep_milli(stats.sleep_time)
+
+    def step (self):
+        """ Runs one pass of the loop without sleeping. Returns its FrameStats, whose sleep_time is
+            how long the loop should sleep before the next pass.
+        """
+        if self.profiler is not None:
+            self.profiler.begin_frame()
+        now = self.clock.get_tick()
+        if self._next_update is None:
+            self._next_update = now
+        stats = FrameStats(now)
+
+        #input
+        while True:
+            key = keyboard.get_input()
+            if not key.code:
+                break
+            self.on_key.fire(self, key)
+            if key.pressed:
+                self._invalid = True
+
+        #fixed updates
+        start = time.time()
+        while self._next_update <= now and stats.updates < self.max_updates:
+            self.on_update.fire(self, self._next_update)
+            self._next_update += self.update_ms
+            stats.updates += 1
+        if self._next_update <= now:
+            self._next_update = now + self.update_ms    #too far behind: drop the missed time
+        if self.animations is not None:
+            self.animations.update(now)
+        stats.update_time = (time.time() - start) * 1000.0
+
+        #rendering
+        start = time.time()
+        if self._invalid and self._next_frame <= now:
+            self._invalid = False
+            self._next_frame = now + self.frame_ms
+            alpha = 1.0 - float(self._next_update - now) / self.update_ms
+            self.on_render.fire(self, alpha)
+            stats.rendered = True
+        root = console.canvas()
+        if root is not None and root.is_dirty():
+            console.flush()
+            stats.flushed = True
+        stats.render_time = (time.time() - start) * 1000.0
+
+        #sleep until something is due. Input is polled at least once a frame
+        wake = min(self._next_update, self.clock.get_tick() + self._poll_ms)
+        if self._invalid:
+            wake = min(wake, self._next_frame)
+        if self.animations is not None and self.animations.next_change() is not None:
+            wake = min(wake, self.animations.next_change())
+        stats.sleep_time = max(wake - self.clock.get_tick(), 0)
+
+        self.stats.append(stats)
+        if self.profiler is not None:
+            if stats.rendered or stats.flushed:
+                self.profiler.end_frame()
+            else:
+                self.profiler.cancel_frame()
+        return stats
+
+    def fps (self):
+        """ Returns the number of renders per second over the passes in stats."""
+        if len(self.stats) < 2:
+            return 0.0
+        elapsed = self.stats[-1].tick - self.stats[0].tick
+        if elapsed <= 0:
+            return 0.0
+        renders = sum(1 for stats in self.stats if stats.rendered)
+        return renders * 1000.0 / elapsed
+
+    def frame_times (self):
+        """ Returns the busy time of each pass in stats that rendered, in milliseconds."""
+        return [stats.busy_time() for stats in self.stats if stats.rendered]
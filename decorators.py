@@ -1,21 +1,38 @@
 #Border
 
-import libtcodpy as dlib
-from widget import Align
-from canvas import CanvasState, CanvasStyle
+import weakref
+from collections import OrderedDict
+
+from backend import dlib
+from widget import Align, LayoutNode, culled, measure
+from canvas import Canvas, CanvasState, CanvasStyle
 from lines import LinePainter
 from misc import Rectangle
 
 class UnboundDecoratorError (Exception): pass
 
-class Decorator(object):
+class Decorator(LayoutNode):
     """ A decorator is a widget that wraps another widget to modify its appearance in some way.
         For example, a Decorator could add a border or background fill, align the widget with a
         coord or anchor it within a rectangular area.
+        The size of a decorator is memoized, and recomputed only when it or its target changes.
     """    
+    _target = None
+    
     def __init__(self, target=None):
         self.target = target
     
+    @property
+    def target (self): return self._target
+    
+    @target.setter
+    def target (self, target):
+        if self._target is not None:
+            self._unlink_child(self._target)
+        self._target = target
+        if target is not None:
+            self._link_child(target)
+    
     def bind (self, target):
         self.target = target
         
@@ -30,9 +47,7 @@ class Decorator(object):
         other.bind(self)
         return other
        
-    def width (self): return self.target.width()
-    
-    def height (self): return self.target.height()
+    def _measure (self): return measure(self.target)
     
     def render(self, canvas, x, y):
         if self.target is None:
@@ -45,15 +60,16 @@ class Fill(Decorator):
         Decorator.__init__(self)
         self.style = CanvasStyle(**style)
         self.target = None
-       
-    def width (self): return self.target.width()
     
-    def height (self): return self.target.height()
+    @property
+    def opaque(self): return self.style.sets_background()
     
+    @culled
     def render(self,canvas,x,y):       
+        w, h = self.measure()
         with CanvasState(canvas,x,y):
             self.style.apply(canvas)
-            canvas.fill_rect(Rectangle(0,0,self.target.width(), self.target.height()))
+            canvas.fill_rect(Rectangle(0,0,w,h))
         #render the target after so that it appears on top of the fill
         self.target.render(canvas,x,y)  
 
@@ -65,9 +81,9 @@ class Padding(Decorator):
         self.top = top or vpad or 0
         self.bottom = bottom or vpad or 0
         
-    def width (self): return self.target.width() + self.left + self.right
-    
-    def height (self): return self.target.height() + self.top + self.bottom
+    def _measure (self): 
+        w, h = measure(self.target)
+        return (w + self.left + self.right, h + self.top + self.bottom)
     
     def render (self, canvas, x, y):
         self.target.render(canvas, x + self.left, y + self.top)
@@ -84,9 +100,9 @@ class Anchor(Decorator):
         self.min_width = min_width
         self.min_height = min_height
         
-    def width (self): return max(self.min_width, self.target.width())
-    
-    def height (self): return max(self.min_height, self.target.height())
+    def _measure (self): 
+        w, h = measure(self.target)
+        return (max(self.min_width, w), max(self.min_height, h))
         
     def _x_inner (self): 
         if self.halign == "left": 
@@ -125,25 +141,21 @@ class Border(Decorator):
         self.top = top
         self.bottom = bottom
         
-    def width (self): 
-        w = self.target.width()
+    def _measure (self): 
+        w, h = measure(self.target)
         if self.left: w += 1
         if self.right: w += 1
-        return w
-    
-    def height (self): 
-        h = self.target.height()
         if self.top: h += 1
         if self.bottom: h += 1
-        return h
+        return (w, h)
         
+    @culled
     def render (self, canvas, x, y):   
         x_off, y_off = 0,0
         if self.top: y_off += 1
         if self.left: x_off += 1
         
-        w = self.width()
-        h = self.height()
+        w, h = self.measure()
         
         #draw target
         self.target.render(canvas, x+x_off, y+y_off)
@@ -159,7 +171,104 @@ class Border(Decorator):
             if self.bottom: lines.add("hline", 0, h-1, w)
 
             lines.paint(canvas)
-            
-            
-            
-            
\ No newline at end of file
+
+
+class RenderCache (object):
+    """ A least recently used cache of the off-screen canvases of Cached decorators.
+        Holds one canvas for each Cached decorator, and discards the least recently used canvases 
+        whenever the total number of cells held is more than max_cells.
+    """
+    def __init__(self, max_cells):
+        self.max_cells = max_cells
+        self.cells = 0
+        self._entries = OrderedDict()   #maps id(owner) to (weakref to owner, key, canvas)
+    
+    def get(self, owner, key):
+        """ Returns the canvas cached for owner under key, or None."""
+        entry = self._entries.get(id(owner))
+        if entry is None or entry[0]() is not owner or entry[1] != key:
+            return None
+        del self._entries[id(owner)]    #move to the most recently used end
+        self._entries[id(owner)] = entry
+        return entry[2]
+    
+    def fits(self, w, h):
+        """ Returns True if a canvas of w x h cells can be held without going over max_cells."""
+        return w * h <= self.max_cells
+    
+    def put(self, owner, key, canvas):
+        """ Holds canvas for owner under key. A canvas that does not fit is not held."""
+        self.discard(owner)
+        if not self.fits(canvas.width, canvas.height):
+            return
+        oid = id(owner)
+        ref = weakref.ref(owner, lambda ref: self._remove(oid, ref))
+        self._entries[oid] = (ref, key, canvas)
+        self.cells += canvas.width * canvas.height
+        while self.cells > self.max_cells and self._entries:
+            self._remove(next(iter(self._entries)))
+    
+    def discard(self, owner):
+        self._remove(id(owner))
+    
+    def clear(self):
+        self._entries.clear()
+        self.cells = 0
+    
+    def _remove(self, oid, ref=None):
+        entry = self._entries.get(oid)
+        if entry is not None and (ref is None or entry[0] is ref):
+            del self._entries[oid]
+            self.cells -= entry[2].width * entry[2].height
+    
+    def __len__(self):
+        return len(self._entries)
+
+#shared by all Cached decorators - about eight 80x50 screens
+render_cache = RenderCache(80*50*8)
+
+
+class Cached(Decorator):
+    """ Renders its target once into an off-screen canvas, and blits that canvas on later renders.
+        
+        The canvas is discarded when the memoized layout of the subtree is invalidated - which happens
+        when an attribute or the style of any widget in it changes - or when the subtree is rendered with 
+        different default colours or background effect. A subtree that contains a widget that is not a 
+        LayoutNode can not be tracked, so it is rendered directly every time. So is a subtree too large for 
+        render_cache to hold, as its canvas would be discarded straight away.
+        
+        The blit replaces every cell of the bounding box of the target, so the subtree should paint all of it,
+        for instance with a Fill as its outermost decorator. The canvases are held by render_cache.
+    """
+    def invalidate_layout(self):
+        Decorator.invalidate_layout(self)
+        render_cache.discard(self)
+    
+    @property
+    def opaque(self):
+        #the blit replaces every cell, whatever the target drew
+        if not self._volatile and render_cache.fits(*self.measure()):
+            return True
+        return getattr(self.target, "opaque", False)
+    
+    @culled
+    def render(self, canvas, x, y):
+        if self.target is None:
+            raise UnboundDecoratorError("cannot render an unbound decorator.")
+        w, h = self.measure()
+        if self._volatile or not render_cache.fits(w, h):
+            self.target.render(canvas, x, y)
+            return
+        if w <= 0 or h <= 0:
+            return
+        key = (tuple(canvas.fg_colour), tuple(canvas.bg_colour), canvas.bg_effect)
+        cached = render_cache.get(self, key)
+        if cached is None:
+            cached = Canvas(w, h, buffered=True)
+            cached.fg_colour = canvas.fg_colour
+            cached.bg_colour = canvas.bg_colour
+            cached.bg_effect = canvas.bg_effect
+            cached.clear()
+            self.target.render(cached, 0, 0)
+            render_cache.put(self, key, cached)
+        cached.blit_to(canvas, x + canvas.x_offset, y + canvas.y_offset)
@@ -0,0 +1,393 @@
+""" Recording of draw calls, to be replayed onto a canvas with as few calls into libTCOD as possible.
+
+    A DisplayList has the drawing interface of a Canvas, so a widget tree renders into it like into any canvas.
+    Nothing is drawn while recording: every call is kept as a command, with the style it was made with.
+    replay() resolves the commands into the final contents of every cell that was written, so cells that are
+    overdrawn by later commands - for instance by panels stacked on top of each other - cost nothing, and then
+    draws the result in runs of cells that share their colours. Runs with the same position and colours on
+    consecutive rows are drawn as one multi-line string or rectangle.
+
+    Background effects that blend with the cells underneath, and blits with a fade, read the target cells
+    they cover back from the canvas, once per cell. Blank cells that were erased without a foreground colour,
+    by fill_rect() for instance, may be drawn with the foreground colour of the characters next to them.
+
+    Using a DisplayList is opt-in, and only pays with the libtcod backend on an unbuffered canvas: recording
+    and resolving cost more Python time than drawing directly, in exchange for far fewer native calls. With
+    the headless backend, or onto a buffered canvas, a call into the console is itself Python, so drawing
+    directly is faster. "python benchmarks.py displaylist" counts the console calls of both.
+"""
+
+from itertools import groupby, izip
+
+from backend import dlib
+from canvas import Canvas, Clipping
+from cells import CellBuffer, cell_code
+from colour import Colour
+from misc import Rectangle
+
+#command types
+PUT, FILL, FILL_RECT, CELL, BLIT, CLEAR = range(6)
+
+#the parts of a cell that were written: character, foreground and background colour
+CH, FG, BG = 1, 2, 4
+ALL = CH | FG | BG
+#a blank character and background with any foreground, which can join a run of characters
+BLANK = 8 | CH | BG
+
+#translation tables that add each combination of written parts to the bytes of a row of written
+_OR_TABLES = [str(bytearray((v | bits) & 0xff for v in range(256))) for bits in range(ALL + 1)]
+
+def _blends(flag):
+    """ Returns True if a background flag combines the new colour with the background underneath."""
+    return flag & 0xff not in (dlib.BKGND_NONE, dlib.BKGND_SET)
+
+
+class DisplayList (Clipping):
+    """ Records draw calls made on an area of width x height cells, to be drawn with replay().
+        The sources of recorded blits are read when the list is replayed, not when the blit is recorded.
+        Commands are clipped to the list and to clip_rect when they are recorded, like the drawing 
+        functions of a Canvas.
+    """
+    def __init__(self, w, h):
+        self._width = w
+        self._height = h
+        self.commands = []
+        self.x_offset = 0
+        self.y_offset = 0
+        self.clip_rect = None
+        self.fg_colour = Colour(255,255,255)
+        self._bg = Colour(0,0,0)
+        self.bg_effect = dlib.BKGND_NONE
+        self._state_stack = []
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def height(self):
+        return self._height
+
+    ## style properties, with the same behaviour as those of a Canvas
+    @property
+    def bg_colour(self):
+        return self._bg
+
+    @bg_colour.setter
+    def bg_colour(self, bg):
+        if bg is None:
+            self.bg_effect = dlib.BKGND_NONE
+        else:
+            if self.bg_effect == dlib.BKGND_NONE:
+                self.bg_effect = dlib.BKGND_SET
+            self._bg = bg
+
+    def push_state(self):
+        self._state_stack.append((self.fg_colour, self._bg, self.bg_effect, self.x_offset, self.y_offset,
+                                  self.clip_rect))
+
+    def pop_state(self):
+        (self.fg_colour, self._bg, self.bg_effect, self.x_offset, self.y_offset,
+         self.clip_rect) = self._state_stack.pop()
+
+    def _style(self):
+        return (tuple(self.fg_colour), tuple(self._bg), self.bg_effect)
+
+    def mark_dirty(self, rect):
+        pass
+
+    def _clipped(self, x, y, w, h):
+        """ Returns the Rectangle of the part of a rectangle that can be drawn on, or None if there is none."""
+        x1, y1, x2, y2 = self._clip(x, y, w, h)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return Rectangle(x1, y1, x2 - x1, y2 - y1)
+
+    ## recording
+    def clear(self):
+        """ Erases every cell. The commands recorded before are dropped, as nothing of them would be visible."""
+        self.commands = [(CLEAR, self._style())]
+
+    def put_char(self, x, y, ch):
+        self._put_run(x + self.x_offset, y + self.y_offset, [cell_code(ch)])
+
+    def printstr(self, x, y, s):
+        x += self.x_offset
+        y += self.y_offset
+        for i, line in enumerate(s.split("\n")):
+            if line:
+                self._put_run(x, y + i, map(ord, line))
+
+    def _put_run(self, x, y, codes):
+        """ Records characters put from x,y to the right, extending the last command if it is a run with the
+            same style that ends at x,y.
+        """
+        rect = self._clipped(x, y, len(codes), 1)
+        if rect is None:
+            return
+        if rect.width < len(codes):
+            x, codes = rect.x, codes[rect.x - x:rect.x - x + rect.width]
+        style = self._style()
+        if self.commands:
+            last = self.commands[-1]
+            if last[0] == PUT and last[2] == y and last[1] + len(last[3]) == x and last[4] == style:
+                last[3].extend(codes)
+                return
+        self.commands.append((PUT, x, y, codes, style))
+
+    def hline(self, x, y, len, ch):
+        self.fill(Rectangle(x, y, len, 1), ch)
+
+    def vline(self, x, y, len, ch):
+        self.fill(Rectangle(x, y, 1, len), ch)
+
+    def fill(self, rect, ch):
+        rect = self._clipped(rect.x + self.x_offset, rect.y + self.y_offset, rect.width, rect.height)
+        if rect is not None:
+            self.commands.append((FILL, rect.x, rect.y, rect.width, rect.height, cell_code(ch) or ord(" "),
+                                  self._style()))
+
+    def fill_rect(self, rect, opaque=True, effect=dlib.BKGND_DEFAULT):
+        if effect == dlib.BKGND_DEFAULT:
+            effect = self.bg_effect
+        rect = self._clipped(rect.x + self.x_offset, rect.y + self.y_offset, rect.width, rect.height)
+        if rect is not None:
+            self.commands.append((FILL_RECT, rect.x, rect.y, rect.width, rect.height, opaque, effect, self._style()))
+
+    def set_cell(self, x, y, ch=None, bg=None, fg=None, bg_effect=dlib.BKGND_DEFAULT):
+        if bg_effect == dlib.BKGND_DEFAULT:
+            bg_effect = self.bg_effect
+        if self._clipped(x + self.x_offset, y + self.y_offset, 1, 1) is None:
+            return
+        self.commands.append((CELL, x + self.x_offset, y + self.y_offset, cell_code(ch) if ch else None,
+                              tuple(fg) if fg else None, tuple(bg) if bg else None, bg_effect))
+
+    def record_blit(self, source, x, y, w, h, xdst, ydst, ffade=1.0, bfade=1.0):
+        """ Records a blit of a w*h area of the canvas source at x,y to xdst,ydst. Called by Canvas.blit_to()."""
+        rect = self._clipped(xdst, ydst, w, h)
+        if rect is None:
+            return
+        x, y = x + rect.x - xdst, y + rect.y - ydst
+        xdst, ydst, w, h = rect.x, rect.y, rect.width, rect.height
+        self.commands.append((BLIT, source, x, y, w, h, xdst, ydst, ffade, bfade))
+
+    ## replaying
+    def replay(self, canvas):
+        """ Draws the recorded commands onto canvas, at its current offsets."""
+        cells = CellBuffer(self._width, self._height)
+        written = bytearray(cells.size)     #the parts of each cell that were written, see CH, FG and BG
+        for command in self.commands:
+            self._resolve(command, canvas, cells, written)
+
+        canvas.push_state()
+        try:
+            self._draw(canvas, cells, written)
+        finally:
+            canvas.pop_state()
+
+    def _resolve(self, command, canvas, cells, written):
+        """ Applies a command to the cells."""
+        kind = command[0]
+        if kind == CLEAR:
+            cells.default_fg, cells.default_bg, effect = command[1]
+            cells.clear()
+            written[:] = bytearray([ALL]) * len(written)
+            return
+
+        if kind == PUT:
+            x, y, codes, (cells.default_fg, cells.default_bg, flag) = command[1:]
+            if _blends(flag):
+                self._load(canvas, cells, written, x, y, len(codes), 1)
+            cells.put_chars(x, y, codes, flag)
+            self._mark(written, x, y, len(codes), 1, CH | FG | (BG if flag != dlib.BKGND_NONE else 0))
+
+        elif kind == FILL:
+            x, y, w, h, c, (cells.default_fg, cells.default_bg, flag) = command[1:]
+            if _blends(flag):
+                self._load(canvas, cells, written, x, y, w, h)
+            cells.fill(x, y, w, h, c, flag)
+            self._mark(written, x, y, w, h, CH | FG | (BG if flag != dlib.BKGND_NONE else 0))
+
+        elif kind == FILL_RECT:
+            x, y, w, h, opaque, flag, (cells.default_fg, cells.default_bg, effect) = command[1:]
+            if _blends(flag):
+                self._load(canvas, cells, written, x, y, w, h)
+            cells.rect(x, y, w, h, opaque, flag)
+            self._mark(written, x, y, w, h, (CH if opaque else 0) | (BG if flag != dlib.BKGND_NONE else 0))
+
+        elif kind == CELL:
+            x, y, c, fg, bg, flag = command[1:]
+            bits = 0
+            if bg:
+                if _blends(flag):
+                    self._load(canvas, cells, written, x, y, 1, 1)
+                cells.set_char_background(x, y, bg, flag)
+                bits |= BG
+            if fg:
+                cells.set_char_foreground(x, y, fg)
+                bits |= FG
+            if c:
+                cells.set_char(x, y, c)
+                bits |= CH
+            self._mark(written, x, y, 1, 1, bits)
+
+        elif kind == BLIT:
+            source, x, y, w, h, xdst, ydst, ffade, bfade = command[1:]
+            if x < 0: w, xdst, x = w + x, xdst - x, 0
+            if y < 0: h, ydst, y = h + y, ydst - y, 0
+            w = min(w, source.width - x)
+            h = min(h, source.height - y)
+            if source._buffer is not None:
+                src = source._buffer
+            else:
+                src, x, y = source._read_cells(x, y, w, h), 0, 0
+            if ffade != 1.0 or bfade != 1.0:
+                self._load(canvas, cells, written, xdst, ydst, w, h)
+            src.blit(x, y, w, h, cells, xdst, ydst, ffade, bfade)
+            self._mark(written, xdst, ydst, w, h, ALL)
+
+    def _inside(self, x, y, w, h):
+        """ Returns the rows y1 to y2 and columns x1 to x2 of a rectangle that are inside the list."""
+        return max(x, 0), max(y, 0), min(x + w, self._width), min(y + h, self._height)
+
+    def _mark(self, written, x, y, w, h, bits):
+        x1, y1, x2, y2 = self._inside(x, y, w, h)
+        if not bits or x1 >= x2:
+            return
+        if bits == ALL:
+            run = bytearray([ALL]) * (x2 - x1)
+            for cy in range(y1, y2):
+                written[cy*self._width+x1:cy*self._width+x2] = run
+            return
+        table = _OR_TABLES[bits]
+        for cy in range(y1, y2):
+            i = cy * self._width
+            written[i+x1:i+x2] = written[i+x1:i+x2].translate(table)
+
+    def _load(self, canvas, cells, written, x, y, w, h):
+        """ Reads the parts of the cells in a rectangle that were not written yet back from the canvas."""
+        x1, y1, x2, y2 = self._inside(x, y, w, h)
+        x2 = min(x2, canvas.width - canvas.x_offset)
+        y2 = min(y2, canvas.height - canvas.y_offset)
+        for cy in range(y1, y2):
+            for cx in range(x1, x2):
+                i = cy * self._width + cx
+                bits = written[i]
+                if bits == ALL:
+                    continue
+                cell = canvas._read_cells(cx + canvas.x_offset, cy + canvas.y_offset, 1, 1)
+                if not bits & CH: cells.ch[i] = cell.ch[0]
+                if not bits & FG: cells._set_rgb(cells.fg, i, cell._get_rgb(cell.fg, 0))
+                if not bits & BG: cells._set_rgb(cells.bg, i, cell._get_rgb(cell.bg, 0))
+                written[i] = ALL
+
+    def _draw(self, canvas, cells, written):
+        """ Draws the written cells in runs of cells that share the same written parts and colours. Runs of
+            printable characters or of backgrounds only are merged with runs of the same position and colours
+            on the rows below, and drawn as a block.
+        """
+        width = self._width
+        blocks = {}     #maps (x, length, key) of each run of the previous row to [y, lines] of its block
+        for y in range(self._height):
+            row_blocks = {}
+            for x, length, key, line in self._runs(cells, written, y):
+                if line is None:
+                    self._draw_cells(canvas, cells, x, y, length, key)
+                    continue
+                block = blocks.pop((x, length, key), None)
+                if block is None:
+                    block = [y, []]
+                block[1].append(line)
+                row_blocks[x, length, key] = block
+            for (x, length, key), (y0, lines) in blocks.iteritems():
+                self._draw_block(canvas, x, y0, length, key, lines)
+            blocks = row_blocks
+        for (x, length, key), (y0, lines) in blocks.iteritems():
+            self._draw_block(canvas, x, y0, length, key, lines)
+
+    def _runs(self, cells, written, y):
+        """ Yields (x, length, key, line) for the runs of written cells of a row, where key is the tuple
+            (written parts, foreground, background) shared by the cells. line is the string of characters
+            of the run, "" for a run of backgrounds and blanks, or None if it can not be drawn as a block.
+            A blank cell whose foreground was not written joins a run of characters with the same background.
+            Only the written span of the row is looked at, and its cells are grouped by slices of the planes.
+        """
+        start = y * self._width
+        row = written[start:start+self._width]
+        end = len(row.rstrip("\0"))
+        if not end:
+            return
+        x = end - len(row[:end].lstrip("\0"))
+        a, b, n = start + x, start + end, cells.size
+        bits_row = written[a:b]
+        if CH | BG in bits_row:
+            codes = cells.ch[a:b]
+            bits_row = bytearray(BLANK if bits == CH | BG and c == 32 else bits for bits, c in izip(bits_row, codes))
+        fg, bg = cells.fg, cells.bg
+        keys = izip(bits_row, fg[a:b], fg[a+n:b+n], fg[a+2*n:b+2*n], bg[a:b], bg[a+n:b+n], bg[a+2*n:b+2*n])
+
+        #runs of cells with the same key, merging blank cells into the runs of characters next to them
+        runs = []
+        for key, group in groupby(keys):
+            length = len(list(group))
+            bits = key[0]
+            if bits:
+                fg_key = key[1:4] if bits & FG else None
+                bg_key = key[4:7] if bits & BG else None
+                if bits == BLANK:
+                    bits = ALL
+                last = runs[-1] if runs else None
+                if (last and last[0] + last[1] == x and last[2] == bits and last[4] == bg_key 
+                        and (not last[3] or not fg_key or last[3] == fg_key)):
+                    last[1] += length
+                    last[3] = last[3] or fg_key
+                else:
+                    runs.append([x, length, bits, fg_key, bg_key])
+            x += length
+
+        for x, length, bits, fg_key, bg_key in runs:
+            if bits == ALL and fg_key is None:
+                bits, line = CH | BG, ""
+            elif bits == BG:
+                line = ""
+            elif bits in (ALL, CH | FG):
+                line = self._line(cells.ch[start+x:start+x+length])
+            else:
+                line = None
+            yield x, length, (bits, fg_key, bg_key), line
+
+    def _line(self, codes):
+        """ Returns the string of a run of character codes, or None if console_print would not print it as it is."""
+        if min(codes) <= 8 or max(codes) >= 256:
+            return None
+        line = str(bytearray(codes.tolist()))
+        if "\n" in line or "%" in line:
+            return None
+        return line
+
+    def _set_style(self, canvas, key):
+        bits, fg, bg = key
+        if fg is not None:
+            canvas.fg_colour = Colour(*fg)
+        if bg is not None:
+            canvas.bg_colour = Colour(*bg)
+        canvas.bg_effect = dlib.BKGND_SET if bg is not None else dlib.BKGND_NONE
+
+    def _draw_block(self, canvas, x, y, length, key, lines):
+        self._set_style(canvas, key)
+        if not key[0] & FG:
+            canvas.fill_rect(Rectangle(x, y, length, len(lines)), key[0] == CH | BG, dlib.BKGND_SET)
+        else:
+            canvas.printstr(x, y, "\n".join(lines))
+
+    def _draw_cells(self, canvas, cells, x, y, length, key):
+        """ Draws a run that is not a block one cell at a time."""
+        bits, fg, bg = key
+        self._set_style(canvas, key)
+        for cx in range(x, x + length):
+            c = cells.get_char(cx, y)
+            if bits in (ALL, CH | FG):
+                canvas.put_char(cx, y, c)
+            else:
+                canvas.set_cell(cx, y, c if bits & CH else None, Colour(*bg) if bg else None,
+                                Colour(*fg) if fg else None, dlib.BKGND_SET)
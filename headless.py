@@ -0,0 +1,363 @@
+""" A headless implementation of the parts of libtcodpy used by this library.
+
+    Every console, including the root console, is a CellBuffer held in memory, so nothing here
+    needs the native libtcod library or a display. This makes it possible to render widget trees
+    on a server, in CI or in benchmarks. Select it by setting ASCII_BACKEND=headless (see backend.py).
+    
+    Console handles are CellBuffer objects; as in libtcod, a handle of None or 0 means the root console.
+    Keyboard input is not supported: the keypress functions return immediately with no key.
+"""
+
+import ctypes
+import time
+from cells import CellBuffer
+from cells import BKGND_NONE, BKGND_SET, BKGND_MULTIPLY, BKGND_LIGHTEN, BKGND_DARKEN, BKGND_SCREEN, \
+    BKGND_COLOR_DODGE, BKGND_COLOR_BURN, BKGND_ADD, BKGND_ADDA, BKGND_BURN, BKGND_OVERLAY, BKGND_ALPH, \
+    BKGND_DEFAULT, LEFT, RIGHT, CENTER
+
+def BKGND_ALPHA(a):
+    return BKGND_ALPH | (int(a * 255) << 8)
+
+def BKGND_ADDALPHA(a):
+    return BKGND_ADDA | (int(a * 255) << 8)
+
+############################
+# color module
+############################
+def _clamp(v):
+    return max(0, min(255, int(v)))
+
+class Color (object):
+    """ Stand-in for the libtcod Color struct, with the same arithmetic."""
+    __slots__ = ("r", "g", "b")
+    
+    def __init__(self, r=0, g=0, b=0):
+        self.r, self.g, self.b = r, g, b
+
+    def __eq__(self, c):
+        return self.r == c.r and self.g == c.g and self.b == c.b
+    
+    def __ne__(self, c):
+        return not self == c
+
+    def __mul__(self, c):
+        if isinstance(c, Color):
+            return Color(self.r * c.r / 255, self.g * c.g / 255, self.b * c.b / 255)
+        return Color(_clamp(self.r * c), _clamp(self.g * c), _clamp(self.b * c))
+
+    def __add__(self, c):
+        return Color(min(255, self.r + c.r), min(255, self.g + c.g), min(255, self.b + c.b))
+
+    def __sub__(self, c):
+        return Color(max(0, self.r - c.r), max(0, self.g - c.g), max(0, self.b - c.b))
+
+    def __repr__(self):
+        return "Color(%d,%d,%d)" % (self.r, self.g, self.b)
+
+    def __getitem__(self, i):
+        if type(i) == str:
+            return getattr(self, i)
+        return getattr(self, "rgb"[i])
+
+    def __setitem__(self, i, c):
+        if type(i) == str:
+            setattr(self, i, c)
+        else:
+            setattr(self, "rgb"[i], c)
+
+    def __iter__(self):
+        yield self.r
+        yield self.g
+        yield self.b
+
+def _rgb(col):
+    return (col.r, col.g, col.b)
+
+def color_lerp(c1, c2, a):
+    return Color(_clamp(c1.r + (c2.r - c1.r) * a), _clamp(c1.g + (c2.g - c1.g) * a), _clamp(c1.b + (c2.b - c1.b) * a))
+
+# special chars
+# single walls
+CHAR_HLINE = 196
+CHAR_VLINE = 179
+CHAR_NE = 191
+CHAR_NW = 218
+CHAR_SE = 217
+CHAR_SW = 192
+CHAR_TEEW = 180
+CHAR_TEEE = 195
+CHAR_TEEN = 193
+CHAR_TEES = 194
+CHAR_CROSS = 197
+# double walls
+CHAR_DHLINE = 205
+CHAR_DVLINE = 186
+CHAR_DNE = 187
+CHAR_DNW = 201
+CHAR_DSE = 188
+CHAR_DSW = 200
+CHAR_DTEEW = 185
+CHAR_DTEEE = 204
+CHAR_DTEEN = 202
+CHAR_DTEES = 203
+CHAR_DCROSS = 206
+# blocks
+CHAR_BLOCK1 = 176
+CHAR_BLOCK2 = 177
+CHAR_BLOCK3 = 178
+# arrows
+CHAR_ARROW_N = 24
+CHAR_ARROW_S = 25
+CHAR_ARROW_E = 26
+CHAR_ARROW_W = 27
+# arrows without tail
+CHAR_ARROW2_N = 30
+CHAR_ARROW2_S = 31
+CHAR_ARROW2_E = 16
+CHAR_ARROW2_W = 17
+# double arrows
+CHAR_DARROW_H = 29
+CHAR_DARROW_V = 18
+# GUI stuff
+CHAR_CHECKBOX_UNSET = 224
+CHAR_CHECKBOX_SET = 225
+CHAR_RADIO_UNSET = 9
+CHAR_RADIO_SET = 10
+# sub-pixel resolution kit
+CHAR_SUBP_NW = 226
+CHAR_SUBP_NE = 227
+CHAR_SUBP_N = 228
+CHAR_SUBP_SE = 229
+CHAR_SUBP_DIAG = 230
+CHAR_SUBP_E = 231
+CHAR_SUBP_SW = 232
+# misc characters
+CHAR_BULLET = 7
+CHAR_BULLET_INV = 8
+CHAR_BULLET_SQUARE = 254
+CHAR_CENT = 189
+CHAR_CLUB = 5
+CHAR_COPYRIGHT = 184
+CHAR_CURRENCY = 207
+CHAR_DIAMOND = 4
+CHAR_DIVISION = 246
+CHAR_EXCLAM_DOUBLE = 19
+CHAR_FEMALE = 12
+CHAR_FUNCTION = 159
+CHAR_GRADE = 248
+CHAR_HALF = 171
+CHAR_HEART = 3
+CHAR_LIGHT = 15
+CHAR_MALE = 11
+CHAR_MULTIPLICATION = 158
+CHAR_NOTE = 13
+CHAR_NOTE_DOUBLE = 14
+CHAR_ONE_QUARTER = 172
+CHAR_PILCROW = 20
+CHAR_POUND = 156
+CHAR_POW1 = 251
+CHAR_POW2 = 253
+CHAR_POW3 = 252
+CHAR_RESERVED = 169
+CHAR_SECTION = 21
+CHAR_SMILIE = 1
+CHAR_SMILIE_INV = 2
+CHAR_SPADE = 6
+CHAR_THREE_QUARTERS = 243
+CHAR_UMLAUT = 249
+CHAR_YEN = 190
+
+############################
+# console module
+############################
+_root = None
+_title = ""
+_fullscreen = False
+
+def _con(con):
+    if not con:
+        return _root
+    return con
+
+def console_init_root(w, h, title, fullscreen=False, renderer=None):
+    global _root, _title, _fullscreen
+    _root = CellBuffer(w, h)
+    _title = title
+    _fullscreen = fullscreen
+
+def console_get_width(con):
+    return _con(con).width
+
+def console_get_height(con):
+    return _con(con).height
+
+def console_is_fullscreen():
+    return _fullscreen
+
+def console_set_fullscreen(fullscreen):
+    global _fullscreen
+    _fullscreen = fullscreen
+
+def console_is_window_closed():
+    return False
+
+def console_set_window_title(title):
+    global _title
+    _title = title
+
+def console_flush():
+    pass
+
+def console_set_default_background(con, col):
+    _con(con).default_bg = _rgb(col)
+
+def console_set_default_foreground(con, col):
+    _con(con).default_fg = _rgb(col)
+
+def console_get_default_background(con):
+    return Color(*_con(con).default_bg)
+
+def console_get_default_foreground(con):
+    return Color(*_con(con).default_fg)
+
+def console_set_background_flag(con, flag):
+    _con(con).bg_flag = flag
+
+def console_get_background_flag(con):
+    return _con(con).bg_flag
+
+def console_set_alignment(con, alignment):
+    _con(con).alignment = alignment
+
+def console_get_alignment(con):
+    return _con(con).alignment
+
+def console_clear(con):
+    _con(con).clear()
+
+def console_put_char(con, x, y, c, flag=BKGND_DEFAULT):
+    _con(con).put_char(x, y, c, flag)
+
+def console_put_char_ex(con, x, y, c, fore, back):
+    _con(con).put_char_ex(x, y, c, _rgb(fore), _rgb(back))
+
+def console_set_char_background(con, x, y, col, flag=BKGND_SET):
+    _con(con).set_char_background(x, y, _rgb(col), flag)
+
+def console_set_char_foreground(con, x, y, col):
+    _con(con).set_char_foreground(x, y, _rgb(col))
+
+def console_set_char(con, x, y, c):
+    _con(con).set_char(x, y, c)
+
+def console_print(con, x, y, fmt):
+    _con(con).print_str(x, y, fmt)
+
+def console_print_ex(con, x, y, flag, alignment, fmt):
+    _con(con).print_str(x, y, fmt, flag, alignment)
+
+def console_rect(con, x, y, w, h, clr, flag=BKGND_DEFAULT):
+    _con(con).rect(x, y, w, h, clr, flag)
+
+def console_hline(con, x, y, l, flag=BKGND_DEFAULT):
+    _con(con).fill(x, y, l, 1, CHAR_HLINE, flag)
+
+def console_vline(con, x, y, l, flag=BKGND_DEFAULT):
+    _con(con).fill(x, y, 1, l, CHAR_VLINE, flag)
+
+def console_get_char_background(con, x, y):
+    return Color(*_con(con).get_char_background(x, y))
+
+def console_get_char_foreground(con, x, y):
+    return Color(*_con(con).get_char_foreground(x, y))
+
+def console_get_char(con, x, y):
+    return _con(con).get_char(x, y)
+
+def console_new(w, h):
+    return CellBuffer(w, h)
+
+def console_blit(src, x, y, w, h, dst, xdst, ydst, ffade=1.0, bfade=1.0):
+    _con(src).blit(x, y, w, h, _con(dst), xdst, ydst, ffade, bfade)
+
+def console_delete(con):
+    pass
+
+def _fill(data, n, *channels):
+    for c, values in enumerate(channels):
+        if len(values) != n:
+            raise TypeError("fill arrays must have one value per cell")
+        if isinstance(values, ctypes.Array):
+            values = str(buffer(values))    #copied as raw memory, like libtcod does
+        data[c*n:(c+1)*n] = type(data)(data.typecode, values)
+
+def console_fill_foreground(con, r, g, b):
+    buf = _con(con)
+    _fill(buf.fg, buf.size, r, g, b)
+
+def console_fill_background(con, r, g, b):
+    buf = _con(con)
+    _fill(buf.bg, buf.size, r, g, b)
+
+def console_fill_char(con, arr):
+    buf = _con(con)
+    _fill(buf.ch, buf.size, arr)
+
+def console_as_text(con=None):
+    """ Returns the characters of a console as a string, one line per row. 
+        Not part of libtcodpy; this is for inspecting what was rendered.
+    """
+    buf = _con(con)
+    rows = []
+    for y in range(buf.height):
+        start = y * buf.width
+        rows.append("".join(chr(c) if c < 256 else "?" for c in buf.ch[start:start + buf.width]))
+    return "\n".join(rows)
+
+# handling keyboard input
+KEY_PRESSED = 1
+KEY_RELEASED = 2
+
+#the key codes, numbered like in libtcodpy
+(KEY_NONE, KEY_ESCAPE, KEY_BACKSPACE, KEY_TAB, KEY_ENTER, KEY_SHIFT, KEY_CONTROL, KEY_ALT,
+ KEY_PAUSE, KEY_CAPSLOCK, KEY_PAGEUP, KEY_PAGEDOWN, KEY_END, KEY_HOME, KEY_UP, KEY_LEFT, KEY_RIGHT,
+ KEY_DOWN, KEY_PRINTSCREEN, KEY_INSERT, KEY_DELETE, KEY_LWIN, KEY_RWIN, KEY_APPS, KEY_0, KEY_1,
+ KEY_2, KEY_3, KEY_4, KEY_5, KEY_6, KEY_7, KEY_8, KEY_9, KEY_KP0, KEY_KP1, KEY_KP2, KEY_KP3,
+ KEY_KP4, KEY_KP5, KEY_KP6, KEY_KP7, KEY_KP8, KEY_KP9, KEY_KPADD, KEY_KPSUB, KEY_KPDIV, KEY_KPMUL,
+ KEY_KPDEC, KEY_KPENTER, KEY_F1, KEY_F2, KEY_F3, KEY_F4, KEY_F5, KEY_F6, KEY_F7, KEY_F8, KEY_F9,
+ KEY_F10, KEY_F11, KEY_F12, KEY_NUMLOCK, KEY_SCROLLLOCK, KEY_SPACE, KEY_CHAR) = range(66)
+
+class Key (object):
+    def __init__(self):
+        self.vk = 0
+        self.c = 0
+        self.pressed = False
+        self.lalt = self.lctrl = self.ralt = self.rctrl = self.shift = False
+
+def console_wait_for_keypress(flush):
+    return Key()
+
+def console_check_for_keypress(flags=2):
+    return Key()
+
+############################
+# sys module
+############################
+_start = time.time()
+_fps = 0
+
+def sys_set_fps(fps):
+    global _fps
+    _fps = fps
+
+def sys_get_fps():
+    return _fps
+
+def sys_sleep_milli(val):
+    time.sleep(val / 1000.0)
+
+def sys_elapsed_milli():
+    return int((time.time() - _start) * 1000)
+
+def sys_elapsed_seconds():
+    return time.time() - _start
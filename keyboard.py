@@ -1,4 +1,4 @@
-import libtcodpy as dlib
+from backend import dlib
 from events import EventSource
 import console
 
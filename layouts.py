@@ -1,47 +1,145 @@
 from canvas import CanvasState
 from decorators import Anchor, Padding, Align
+from misc import Rectangle, Region
+from widget import LayoutNode, LayoutList, culled, measure
 
 
-class VerticalFlow(object):
-    """ Attributes
-        items: a list of items to display.
+class _Flow(LayoutNode):
+    """ Base class for layouts that keep their children in an items list.
+        The size of each child is measured once per layout change, together with its position 
+        in the flow (see _arrange).
     """
     def __init__(self):
         self.items = []
     
-    def width(self):
-        return max([item.width() for item in self.items])
+    @property
+    def items(self): return self._items
     
-    def height(self):
-        return sum([item.height() for item in self.items])
-        
+    @items.setter
+    def items(self, items):
+        for item in getattr(self, "_items", ()):
+            self._unlink_child(item)
+        self._items = LayoutList(self, items)
+    
+    def _measure(self):
+        sizes = [measure(item) for item in self.items]
+        self._positions = self._arrange(sizes)
+        return self._bounds(sizes)
+    
+    @culled
     def render(self, canvas, x, y):
+        self.measure()  #also arranges the children if anything changed
         with CanvasState(canvas, x, y):
-            y = 0
-            for item in self.items:
-                item.render(canvas,0,y)
-                y += item.height()
+            for item, (ix, iy) in zip(self.items, self._positions):
+                item.render(canvas,ix,iy)
+
+
+class VerticalFlow(_Flow):
+    """ Attributes
+        items: a list of items to display.
+    """
+    def _bounds(self, sizes):
+        return (max([w for w, h in sizes] or [0]), sum([h for w, h in sizes]))
+    
+    def _arrange(self, sizes):
+        positions, y = [], 0
+        for w, h in sizes:
+            positions.append((0, y))
+            y += h
+        return positions
                 
                 
-class HorizontalFlow(object):
+class HorizontalFlow(_Flow):
     """ Attributes
         items: a list of items to display.
     """
+    def _bounds(self, sizes):
+        return (sum([w for w, h in sizes]), max([h for w, h in sizes] or [0]))
+    
+    def _arrange(self, sizes):
+        positions, x = [], 0
+        for w, h in sizes:
+            positions.append((x, 0))
+            x += w
+        return positions
+
+class AbsoluteLayout(LayoutNode):
+    """ Places each item at a fixed position, aligned to it like with Align, and draws the items in order of 
+        increasing zlevel; items with the same zlevel are drawn in the order they were added.
+        
+        Items that are covered by opaque items above them (see LayoutNode) are not drawn: an item that is 
+        completely hidden is skipped, and one that is partly hidden is drawn with the canvas clipped to each 
+        rectangle of its visible region in turn, so no cell of it is written under an opaque item. When the 
+        visible region has more than MAX_CLIP_PIECES rectangles, an item that is not simple (see LayoutNode) 
+        is drawn once, clipped to their bounding box, instead. Which parts are visible is worked out once per layout change.
+        The opaque argument of add() overrides the opaque attribute of the item.
+    """
+    
+    #an item is rendered once per rectangle of its visible region up to this many rectangles
+    MAX_CLIP_PIECES = 8
+    
     def __init__(self):
-        self.items = []
+        self._entries = []  #(zlevel, sequence, item, x, y, halign, valign, opaque), in drawing order
+        self._next_seq = 0
     
-    def width(self):
-        return sum([item.width() for item in self.items])
+    @property
+    def items(self):
+        """ The items in drawing order."""
+        return [entry[2] for entry in self._entries]
     
-    def height(self):
-        return max([item.height() for item in self.items])
+    def add(self, item, x, y, halign="left", valign="top", zlevel=0, opaque=None):
+        self._entries.append((zlevel, self._next_seq, item, x, y, halign, valign, opaque))
+        self._entries.sort(key=lambda entry: entry[:2])
+        self._next_seq += 1
+        self._link_child(item)
+        self.invalidate_layout()
+    
+    def remove(self, item):
+        """ Removes every placement of item."""
+        self._entries = [entry for entry in self._entries if entry[2] is not item]
+        self._unlink_child(item)
+        self.invalidate_layout()
+    
+    def _measure(self):
+        rects = []
+        for zlevel, seq, item, x, y, halign, valign, opaque in self._entries:
+            align = Align(item, halign=halign, valign=valign)
+            w, h = measure(item)
+            rects.append(Rectangle(x + align.x_offset(), y + align.y_offset(), w, h))
+        
+        #the rectangles to clip each item that can be seen to, or None if nothing hides it
+        self._placements = []
+        for i, (entry, rect) in enumerate(zip(self._entries, rects)):
+            visible = None
+            for above, above_rect in zip(self._entries[i+1:], rects[i+1:]):
+                opaque = above[7] if above[7] is not None else getattr(above[2], "opaque", False)
+                if opaque and rect.intersection(above_rect) is not None:
+                    if visible is None:
+                        visible = Region([rect], max_rects=None)
+                    visible.subtract(above_rect)
+                    if not len(visible):
+                        break
+            if visible is None:
+                self._placements.append((entry[2], rect, None))
+            elif len(visible) > self.MAX_CLIP_PIECES and not getattr(entry[2], "simple", False):
+                self._placements.append((entry[2], rect, [visible.bounds()]))
+            elif len(visible):
+                self._placements.append((entry[2], rect, list(visible)))
+        
+        return (max([rect.x + rect.width for rect in rects] or [0]), 
+                max([rect.y + rect.height for rect in rects] or [0]))
     
     def render(self, canvas, x, y):
+        self.measure()  #also works out the visible regions if anything changed
         with CanvasState(canvas, x, y):
-            x = 0
-            for item in self.items:
-                item.render(canvas,x,0)
-                x += item.width()
+            for item, rect, clips in self._placements:
+                if clips is None:
+                    item.render(canvas, rect.x, rect.y)
+                    continue
+                for clip in clips:
+                    with CanvasState(canvas, clip=clip):
+                        item.render(canvas, rect.x, rect.y)
+
 
 #TODO
 class GridFlow(object):
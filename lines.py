@@ -1,21 +1,55 @@
+import bisect
+from collections import OrderedDict
 
-import libtcodpy as dlib
+from backend import dlib
 from canvas import CanvasState
-from misc import OrthoLine
+from misc import OrthoLine, Rectangle
+
+#connectivity of a cell: the directions in which lines leave it
+N, E, S, W = 1, 2, 4, 8
+
+#the connectivity mask of each named glyph
+GLYPH_MASKS = {
+    "h": E|W, "v": N|S,
+    "nw": E|S, "ne": S|W, "sw": N|E, "se": N|W,
+    "te": N|E|S, "tw": N|S|W, "tn": N|E|W, "ts": E|S|W,
+    "x": N|E|S|W,
+}
 
-#TODO implement dashed lines
 class LineStyle (object):
-    def __init__(self, default, **ch_dict):
+    """ The characters used to draw lines and their junctions.
+        Characters are given by name (see GLYPH_MASKS), and any that are missing are drawn with default.
+        The style is compiled into glyphs, a list of 16 characters indexed by a N/E/S/W connectivity mask,
+        so the character of any cell is a single list lookup. A cell where a line only leaves in one
+        direction is drawn as the straight line.
+        If dash is a tuple (on, off), lines are drawn with on cells followed by off cells that are left
+        untouched, where on must be positive and off can not be negative. Junctions are always drawn.
+    """
+    def __init__(self, default, dash=None, **ch_dict):
+        if dash is not None:
+            on, off = dash
+            if on <= 0 or off < 0:
+                raise ValueError("dash must be (on, off) with on > 0 and off >= 0, got %r"%(dash,))
         ch_dict[None] = default
         self.char_dict = dict(ch_dict)
+        self.dash = dash
+        self._chars = set(self.char_dict.itervalues())
+        
+        self.glyphs = [default] * 16
+        for name, mask in GLYPH_MASKS.iteritems():
+            if name in ch_dict:
+                self.glyphs[mask] = ch_dict[name]
+        self.glyphs[N] = self.glyphs[S] = self.glyphs[N|S]
+        self.glyphs[E] = self.glyphs[W] = self.glyphs[E|W]
         
     def __contains__(self, char):
-        return char in self.char_dict.values()
+        return char in self._chars
         
     def __getitem__(self, key):
-        if key not in self.char_dict:
-            return self.char_dict[None]
-        return self.char_dict[key]
+        """ Returns the character for a glyph name, or for a connectivity mask."""
+        if isinstance(key, int):
+            return self.glyphs[key]
+        return self.char_dict.get(key, self.glyphs[0])
         
     def __iter__(self):
         return iter(self.char_dict.itervalues())
@@ -53,15 +87,33 @@ double_line = LineStyle(
 #linetype enum
 
 class LinePainter(object):
+    """ Paints a set of horizontal and vertical lines, and the junctions where they meet.
+        The lines are indexed by the row (horizontal lines) or the column (vertical lines) they are on,
+        so point and rectangle queries only look at the lines on the rows and columns involved, and
+        the junctions are found with a sweep over the columns in O(n log n + k) for n lines and k junctions.
+    """
     
     class DrawingLine(OrthoLine):
         def __init__(self,type,x,y,length,style):
             OrthoLine.__init__(self,type,x,y,length)
             self.style = style
+        
+        def _mask(self, cell):
+            """ Returns the connectivity mask of the line at the given cell along it."""
+            pos, first, last = self._span()
+            if self.type == OrthoLine.HLINE:
+                return (E if cell < last else 0) | (W if cell > first else 0)
+            return (S if cell < last else 0) | (N if cell > first else 0)
+        
+        def _span(self):
+            """ Returns (pos, first, last): the row or column the line is on and the first and last cell along it."""
+            if self.type == OrthoLine.HLINE:
+                return self.y, self.x, self.x + self.length - 1
+            return self.x, self.y, self.y + self.length - 1
     
     def __init__(self, default_linestyle):
         self.default_linestyle = default_linestyle
-        self._lines = []
+        self.clear()
         
     def add(self, type, x, y, length, style=None):
         """ Adds a line of the specified type starting at (x,y) and having a length in cells.
@@ -69,112 +121,149 @@ class LinePainter(object):
             Lines of type VLINE are drawn down from the starting point.
         """
         if length < 0: raise ValueError("length cannot be negative")
-        self._lines.append(self.DrawingLine(type,x,y,length,style))
+        if type not in (OrthoLine.HLINE, OrthoLine.VLINE): raise ValueError("unknown line type: %s"%type)
+        line = self.DrawingLine(type,x,y,length,style)
+        line._seq = self._next_seq
+        self._next_seq += 1
+        self._lines[line._seq] = line
+        
+        index, keys = self._index(type)
+        pos = line._span()[0]
+        if pos not in index:
+            index[pos] = []
+            bisect.insort(keys, pos)
+        index[pos].append(line)
                
     def remove(self, line):
         """ Removes the given line."""
-        self._lines.remove(line)
+        if self._lines.get(getattr(line, "_seq", None)) is not line:
+            raise ValueError("line is not in this LinePainter")
+        del self._lines[line._seq]
+        index, keys = self._index(line.type)
+        pos = line._span()[0]
+        index[pos].remove(line)
+        if not index[pos]:
+            del index[pos]
+            del keys[bisect.bisect_left(keys, pos)]
         
     def remove_lines(self, x, y):
         """ Remove all lines that pass through the given point."""
         for line in self.get_lines(x,y):
-            self._lines.remove(line)
+            self.remove(line)
                    
     def remove_lines_rect(self, rect):
         """ Remove all lines that intersect the given rectangle, including edges."""
-        raise NotImplementedError("not implemented yet")
+        for line in self.get_lines_rect(rect):
+            self.remove(line)
     
     def get_lines(self, x, y):
         """ Get the lines that interect a point."""
+        return self.get_lines_rect(Rectangle(x, y, 1, 1))
+    
+    def get_lines_rect(self, rect):
+        """ Get the lines that have at least one cell inside the given rectangle, in the order they were added."""
+        if rect.width <= 0 or rect.height <= 0:
+            return []
+        x1, y1 = rect.x, rect.y
+        x2, y2 = rect.x + rect.width - 1, rect.y + rect.height - 1
+        result = self._find(self._rows, self._row_keys, y1, y2, x1, x2)
+        result.extend(self._find(self._cols, self._col_keys, x1, x2, y1, y2))
+        result.sort(key=lambda line: line._seq)
+        return result
+    
+    def _find(self, index, keys, pos1, pos2, first, last):
+        """ Returns the lines of an index on rows or columns pos1 to pos2 that overlap the cells first to last."""
         result = []
-        for line in self._lines:
-            if line.type == OrthoLine.VLINE and line.x == x:
-                dist = abs(y - line.y)
-            elif line.type == OrthoLine.HLINE and line.y == y:
-                dist = abs(x - line.x)
-            else:
-                continue
-                
-            if dist < line.length - 1:
-                result.append(line)
+        for i in range(bisect.bisect_left(keys, pos1), bisect.bisect_right(keys, pos2)):
+            for line in index[keys[i]]:
+                pos, start, end = line._span()
+                if start <= last and first <= end and start <= end:
+                    result.append(line)
         return result
     
+    def _index(self, type):
+        if type == OrthoLine.HLINE:
+            return self._rows, self._row_keys
+        return self._cols, self._col_keys
+    
     def clear(self):
         """ Removes all lines."""
-        self._lines = []
+        self._lines = OrderedDict()  #maps the sequence number of each line to the line, in the order they were added
+        self._rows = {}         #maps a row to the horizontal lines on it
+        self._cols = {}         #maps a column to the vertical lines on it
+        self._row_keys = []     #the keys of _rows and _cols in sorted order
+        self._col_keys = []
+        self._next_seq = 0
     
-    #TODO: should be tested
-    def _cross(self, line, other_lines):
-        """ Get the points where the given line cross any line in the Lines object
-            (only vertical lines can cross horizontal lines and vice versa).
-            Returns a dict mapping tuples (x,y) to an intersection type "nw", "tn", "x", etc.
-        """ 
-        result = {}
-        for other in other_lines:
-            #x1, x2, y1, y2 -> endpoints of lines
-            #(x,y) location of intersection
-            if line.type == OrthoLine.HLINE and other.type == OrthoLine.VLINE:
-                hline = line
-                vline = other
-            elif line.type == OrthoLine.VLINE and other.type == OrthoLine.HLINE:
-                hline = other
-                vline = line
-            else:
+    def _crossings(self):
+        """ Returns a list of (hline, vline, x, y) for every pair of lines that cross, ordered by
+            the pair of lines in the order they were added.
+            The columns are swept from left to right, keeping the horizontal lines that span the current column
+            sorted by row, so the crossings of a vertical line are found with a binary search.
+        """
+        ADD, QUERY, DROP = 0, 1, 2      #order of the events on the same column
+        events = []
+        for line in self._lines.itervalues():
+            if line.length <= 0:
                 continue
-            
-            x1, x2 = hline.x, hline.x + hline.length - 1    #endpoints of horizontal line
-            y1, y2 = vline.y, vline.y + vline.length - 1    #endpoints of vertical line
-            x, y = vline.x, hline.y                         #location of intersection
-            
-            if (x < x1 or x2 < x) or (y < y1 or y2 < y):
-                continue    #no crossing
-            elif x == x1 and y == y1:   #NW corner
-                result[x,y] = "nw"
-            elif x == x1 and y == y2:   #SW corner
-                result[x,y] = "sw"
-            elif x == x2 and y == y1:   #NE corner
-                result[x,y] = "ne"
-            elif x == x2 and y == y2:   #SE corner
-                result[x,y] = "se"
-            elif y == y1 and (x1 < x and x < x2):   #T pointing S
-                result[x,y] = "ts"
-            elif y == y2 and (x1 < x and x < x2):   #T pointing N
-                result[x,y] = "ts"
-            elif x == x1 and (y1 < y and y < y2):   #T pointing E
-                result[x,y] = "te"
-            elif x == x2 and (y1 < y and y < y2):   #T pointing W
-                result[x,y] = "tw"
-            elif (x1 < x and x < x2) and (y1 < y and y < y2):   #cross
-                result[x,y] = "x"
+            pos, start, end = line._span()
+            if line.type == OrthoLine.HLINE:
+                events.append((start, ADD, line._seq, line))
+                events.append((end, DROP, line._seq, line))
             else:
-                assert False, "unhandled case: (x1=%d, x2=%d), (y1=%d, y2=%d), (x=%d, y=%d)"%(x1,x2,y1,y2,x,y)
+                events.append((pos, QUERY, line._seq, line))
+        events.sort()
         
-        return result
+        active = []     #(row, seq, hline) of the horizontal lines that span the current column
+        result = []
+        for x, kind, seq, line in events:
+            if kind == ADD:
+                bisect.insort(active, (line.y, seq, line))
+            elif kind == DROP:
+                del active[bisect.bisect_left(active, (line.y, seq, line))]
+            else:
+                pos, y1, y2 = line._span()
+                for i in range(bisect.bisect_left(active, (y1,)), bisect.bisect_left(active, (y2 + 1,))):
+                    hline = active[i][2]
+                    result.append((min(seq, hline._seq), max(seq, hline._seq), hline, line))
+        result.sort(key=lambda crossing: crossing[:2])
+        return [(hline, vline, vline.x, hline.y) for a, b, hline, vline in result]
         
-    def __iter__(self): return iter(self._lines)
+    def __iter__(self): return self._lines.itervalues()
     
     def __len__(self): return len(self._lines)
            
     def paint(self, canvas):           
             #draw lines
-            for line in self._lines:
+            for line in self._lines.itervalues():
                 linestyle = line.style or self.default_linestyle
-                if line.type == OrthoLine.HLINE:
-                    canvas.hline(line.x, line.y, line.length, linestyle["h"])
-                elif line.type == OrthoLine.VLINE:
-                    canvas.vline(line.x, line.y, line.length, linestyle["v"])
+                draw = canvas.hline if line.type == OrthoLine.HLINE else canvas.vline
+                glyph = linestyle.glyphs[E|W if line.type == OrthoLine.HLINE else N|S]
+                if not linestyle.dash:
+                    draw(line.x, line.y, line.length, glyph)
+                    continue
+                on, off = linestyle.dash
+                for dash in range(0, line.length, on + off):
+                    length = min(on, line.length - dash)
+                    if line.type == OrthoLine.HLINE:
+                        draw(line.x + dash, line.y, length, glyph)
+                    else:
+                        draw(line.x, line.y + dash, length, glyph)
+            
+            #combine the connectivity of every line that meets at a junction. The junction is drawn in 
+            #the style of the line that was added first, which is in the first crossing at that point.
+            junctions = OrderedDict()
+            for hline, vline, x, y in self._crossings():
+                mask = hline._mask(x) | vline._mask(y)
+                junction = junctions.get((x, y))
+                if junction is None:
+                    first = hline if hline._seq < vline._seq else vline
+                    junctions[x, y] = [mask, first.style or self.default_linestyle]
                 else:
-                    raise ValueError("unknown line type: %d"%line.type)
+                    junction[0] |= mask
             
-            #place intersections
-            lines = list(reversed(self._lines))
-            while len(lines) > 1:   #one line can't cross itself
-                linestyle = line.style or self.default_linestyle
-                line = lines.pop()
-                cross_points = self._cross(line, lines)
-                for pos, cross_char in cross_points.iteritems():
-                    x,y = pos
-                    canvas.put_char(x,y,linestyle[cross_char])
+            for (x, y), (mask, linestyle) in junctions.iteritems():
+                canvas.put_char(x, y, linestyle.glyphs[mask])
                     
             
 if __name__ == "__main__":
@@ -34,6 +34,113 @@ class Rectangle (object):
         div_y = (oy1 < y1 and oy2 < y1) or (oy1 > y2 and oy2 > y2)
         return not div_x and not div_y
     
+    def area (self):
+        return self.width * self.height
+    
+    def intersection (self, rect):
+        """Returns the Rectangle where the given Rectangle overlaps this one, or None if they do not overlap."""
+        x1, y1 = max(self.x, rect.x), max(self.y, rect.y)
+        x2 = min(self.x + self.width, rect.x + rect.width)
+        y2 = min(self.y + self.height, rect.y + rect.height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return Rectangle(x1, y1, x2 - x1, y2 - y1)
+    
+    def bounds (self, rect):
+        """Returns the smallest Rectangle that contains both this Rectangle and the given one."""
+        x1, y1 = min(self.x, rect.x), min(self.y, rect.y)
+        x2 = max(self.x + self.width, rect.x + rect.width)
+        y2 = max(self.y + self.height, rect.y + rect.height)
+        return Rectangle(x1, y1, x2 - x1, y2 - y1)
+    
+    def subtract (self, rect):
+        """Returns a list of up to four disjoint Rectangles that cover the part of this Rectangle 
+        that is not covered by the given one.
+        """
+        inter = self.intersection(rect)
+        if inter is None:
+            return [self]
+        result = []
+        x2, y2 = self.x + self.width, self.y + self.height
+        ix2, iy2 = inter.x + inter.width, inter.y + inter.height
+        if inter.y > self.y:   #above
+            result.append(Rectangle(self.x, self.y, self.width, inter.y - self.y))
+        if iy2 < y2:           #below
+            result.append(Rectangle(self.x, iy2, self.width, y2 - iy2))
+        if inter.x > self.x:   #left
+            result.append(Rectangle(self.x, inter.y, inter.x - self.x, inter.height))
+        if ix2 < x2:           #right
+            result.append(Rectangle(ix2, inter.y, x2 - ix2, inter.height))
+        return result
+    
+
+class Region (object):
+    """ An area made up of a list of disjoint Rectangles. 
+        If adding a Rectangle would split the region into more than max_rects pieces, the region
+        is simplified to its bounding box. A max_rects of None never simplifies it.
+    """
+    def __init__ (self, rects=(), max_rects=64):
+        self.max_rects = max_rects
+        self._rects = []
+        for rect in rects:
+            self.add(rect)
+    
+    def add (self, rect):
+        """Adds the area covered by a Rectangle to this region."""
+        if rect.width <= 0 or rect.height <= 0:
+            return
+        pieces = [rect]
+        for existing in self._rects:
+            if existing.overlaps(rect):
+                pieces = [part for piece in pieces for part in piece.subtract(existing)]
+        self._rects.extend(pieces)
+        if self.max_rects is not None and len(self._rects) > self.max_rects:
+            self._rects = [self.bounds()]
+    
+    def subtract (self, rect):
+        """Removes the area covered by a Rectangle from this region."""
+        rects = []
+        for existing in self._rects:
+            rects.extend(existing.subtract(rect))
+        self._rects = rects
+    
+    def intersection (self, rect):
+        """Returns a new Region containing the parts of this region that are inside the given Rectangle."""
+        result = Region(max_rects=self.max_rects)
+        for existing in self._rects:
+            inter = existing.intersection(rect)
+            if inter is not None:
+                result._rects.append(inter)
+        return result
+    
+    def overlaps (self, rect):
+        for existing in self._rects:
+            if existing.overlaps(rect):
+                return True
+        return False
+    
+    def bounds (self):
+        """Returns the bounding box of this region, or None if it is empty."""
+        if not self._rects:
+            return None
+        result = self._rects[0]
+        for rect in self._rects[1:]:
+            result = result.bounds(rect)
+        return result
+    
+    def area (self):
+        return sum(rect.area() for rect in self._rects)
+    
+    def clear (self):
+        self._rects = []
+    
+    def __iter__ (self): return iter(self._rects)
+    
+    def __len__ (self): return len(self._rects)
+    
+    def __repr__ (self):
+        return "<%s.Region object: %s>"%(self.__module__, self._rects)
+    
         
 class OrthoLine (object):
     """ Represents a line that may be either horizontal or vertical."""
@@ -0,0 +1,303 @@
+""" Opt-in instrumentation of rendering.
+
+    A Profiler records, for each frame between begin_frame() and end_frame():
+        - the wall time and the number of calls of render() of each widget class, under the name of the class
+          that defines the render() method
+        - the wall time and the number of calls of each Canvas primitive, and of entering a CanvasState
+        - the number of calls of each function of the backend, which are the calls into libtcod
+        - the number of cells written, as marked dirty on the canvases
+    The last history frames are kept in a ring buffer. report() summarizes them, and ProfilerOverlay shows the
+    frame rate, the frame time percentiles and the slowest widget classes live.
+
+    Nothing is instrumented until enable() is called, which wraps the methods and functions involved, and
+    disable() puts the originals back.
+"""
+
+import collections
+import functools
+import time
+import types
+
+from backend import dlib
+from canvas import Canvas, CanvasState, CanvasStyle
+from widget import LayoutNode, culled
+
+#the Canvas methods that are timed
+PRIMITIVES = ("put_char", "printstr", "hline", "vline", "fill", "fill_rect", "set_cell", "blit_to", "clear",
+              "fill_foreground", "fill_background", "sync")
+
+
+class FrameProfile (object):
+    """ What was recorded during one frame. Times are in milliseconds.
+        widgets maps a widget class name to [calls, total time, self time], where the self time leaves out
+        the time spent rendering child widgets. primitives maps the name of a canvas primitive to
+        [calls, total time], and ffi maps the name of a backend function to its number of calls.
+    """
+    def __init__ (self, start):
+        self.start = start
+        self.duration = 0.0
+        self.widgets = {}
+        self.primitives = {}
+        self.ffi = {}
+        self.cells = 0
+
+
+def percentile (values, p):
+    """ Returns the p-th percentile (0-100) of a sequence of numbers, by the nearest rank."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class Profiler (object):
+    """ Records FrameProfiles in a ring buffer of the last history frames, see the module documentation."""
+    def __init__ (self, history=120):
+        self.frames = collections.deque(maxlen=history)  #the FrameProfiles of the last frames, oldest first
+        self.current = None     #the FrameProfile being recorded, or None between frames
+        self._saved = []        #(owner, name, original) for every method and function that was wrapped
+        self._child_time = []   #for each widget render in progress, the time spent in the renders it called
+
+    @property
+    def enabled (self):
+        return len(self._saved) > 0
+
+    ## instrumentation
+    def enable (self, classes=()):
+        """ Instruments the render() method of every LayoutNode class that is defined at this point, and of
+            the given classes of widgets that are not LayoutNodes, the Canvas primitives and the backend.
+        """
+        if self.enabled:
+            return
+        widget_classes = list(classes)
+        pending = [LayoutNode]
+        while pending:
+            cls = pending.pop()
+            widget_classes.append(cls)
+            pending.extend(cls.__subclasses__())
+        for cls in widget_classes:
+            if "render" in cls.__dict__:
+                self._wrap(cls, "render", self._timed_render(cls.__name__, cls.__dict__["render"]))
+
+        for name in PRIMITIVES:
+            self._wrap(Canvas, name, self._timed_primitive(name, Canvas.__dict__[name]))
+        self._wrap(CanvasState, "__enter__", self._timed_primitive("CanvasState", CanvasState.__dict__["__enter__"]))
+        self._wrap(Canvas, "mark_dirty", self._counted_cells(Canvas.__dict__["mark_dirty"]))
+        self._wrap(Canvas, "_mark_cell", self._counted_cell(Canvas.__dict__["_mark_cell"]))
+
+        for name in dir(dlib):
+            func = getattr(dlib, name)
+            if not name.startswith("_") and isinstance(func, types.FunctionType):
+                self._wrap(dlib, name, self._counted_call(name, func))
+
+    def disable (self):
+        """ Puts back every method and function that enable() wrapped."""
+        for owner, name, original in reversed(self._saved):
+            setattr(owner, name, original)
+        self._saved = []
+
+    def _wrap (self, owner, name, wrapper):
+        self._saved.append((owner, name, getattr(owner, name) if isinstance(owner, types.ModuleType)
+                                               else owner.__dict__[name]))
+        setattr(owner, name, wrapper)
+
+    def _timed_render (self, name, render):
+        profiler = self
+        @functools.wraps(render)
+        def timed_render (*args, **kwargs):
+            frame = profiler.current
+            if frame is None:
+                return render(*args, **kwargs)
+            profiler._child_time.append(0.0)
+            start = time.time()
+            try:
+                return render(*args, **kwargs)
+            finally:
+                elapsed = (time.time() - start) * 1000.0
+                child_time = profiler._child_time.pop()
+                if profiler._child_time:
+                    profiler._child_time[-1] += elapsed
+                stats = frame.widgets.get(name)
+                if stats is None:
+                    stats = frame.widgets[name] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] += elapsed - child_time
+        return timed_render
+
+    def _timed_primitive (self, name, method):
+        profiler = self
+        @functools.wraps(method)
+        def timed_primitive (*args, **kwargs):
+            frame = profiler.current
+            if frame is None:
+                return method(*args, **kwargs)
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats = frame.primitives.get(name)
+                if stats is None:
+                    stats = frame.primitives[name] = [0, 0.0]
+                stats[0] += 1
+                stats[1] += (time.time() - start) * 1000.0
+        return timed_primitive
+
+    def _counted_call (self, name, func):
+        profiler = self
+        @functools.wraps(func)
+        def counted_call (*args, **kwargs):
+            frame = profiler.current
+            if frame is not None:
+                frame.ffi[name] = frame.ffi.get(name, 0) + 1
+            return func(*args, **kwargs)
+        return counted_call
+
+    def _counted_cells (self, mark_dirty):
+        profiler = self
+        @functools.wraps(mark_dirty)
+        def counted_mark_dirty (canvas, rect):
+            frame = profiler.current
+            if frame is not None:
+                w = min(rect.x + rect.width, canvas.width) - max(rect.x, 0)
+                h = min(rect.y + rect.height, canvas.height) - max(rect.y, 0)
+                if w > 0 and h > 0:
+                    frame.cells += w * h
+            return mark_dirty(canvas, rect)
+        return counted_mark_dirty
+
+    def _counted_cell (self, mark_cell):
+        profiler = self
+        @functools.wraps(mark_cell)
+        def counted_mark_cell (canvas, x, y):
+            frame = profiler.current
+            if frame is not None and 0 <= x < canvas.width and 0 <= y < canvas.height:
+                frame.cells += 1
+            return mark_cell(canvas, x, y)
+        return counted_mark_cell
+
+    ## frames
+    def begin_frame (self):
+        self.current = FrameProfile(time.time())
+        self._child_time = []
+
+    def end_frame (self):
+        frame = self.current
+        if frame is None:
+            return
+        frame.duration = (time.time() - frame.start) * 1000.0
+        self.frames.append(frame)
+        self.current = None
+
+    def cancel_frame (self):
+        """ Drops the frame being recorded, for instance when nothing was drawn in it."""
+        self.current = None
+
+    def fps (self):
+        """ Returns the number of frames per second over the frames in the ring buffer."""
+        if len(self.frames) < 2:
+            return 0.0
+        first, last = self.frames[0], self.frames[-1]
+        elapsed = last.start - first.start
+        if elapsed <= 0:
+            return 0.0
+        return (len(self.frames) - 1) / elapsed
+
+    def frame_times (self):
+        return [frame.duration for frame in self.frames]
+
+    def widget_totals (self):
+        """ Returns a list of (class name, calls, total time, self time) summed over the frames in the
+            ring buffer, slowest self time first.
+        """
+        totals = {}
+        for frame in self.frames:
+            for name, (calls, total, own) in frame.widgets.iteritems():
+                stats = totals.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += calls
+                stats[1] += total
+                stats[2] += own
+        result = [(name, calls, total, own) for name, (calls, total, own) in totals.iteritems()]
+        result.sort(key=lambda item: -item[3])
+        return result
+
+    def primitive_totals (self):
+        """ Returns a list of (primitive name, calls, total time) summed over the frames in the ring buffer,
+            slowest first.
+        """
+        totals = {}
+        for frame in self.frames:
+            for name, (calls, total) in frame.primitives.iteritems():
+                stats = totals.setdefault(name, [0, 0.0])
+                stats[0] += calls
+                stats[1] += total
+        result = [(name, calls, total) for name, (calls, total) in totals.iteritems()]
+        result.sort(key=lambda item: -item[2])
+        return result
+
+    def ffi_totals (self):
+        """ Returns a list of (backend function name, calls) summed over the frames in the ring buffer,
+            most called first.
+        """
+        totals = {}
+        for frame in self.frames:
+            for name, calls in frame.ffi.iteritems():
+                totals[name] = totals.get(name, 0) + calls
+        return sorted(totals.iteritems(), key=lambda item: -item[1])
+
+    def report (self, top=10):
+        """ Returns a text report of the frames in the ring buffer, with averages per frame."""
+        count = len(self.frames)
+        if count == 0:
+            return "no frames recorded"
+        times = self.frame_times()
+        lines = ["%d frames, %.1f fps, frame time p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms" %
+                 (count, self.fps(), percentile(times, 50), percentile(times, 90), percentile(times, 99), max(times)),
+                 "cells written per frame: %.0f" % (sum(frame.cells for frame in self.frames) / float(count)),
+                 "",
+                 "%-28s %10s %12s %12s" % ("widget class", "calls", "total ms", "self ms")]
+        for name, calls, total, own in self.widget_totals()[:top]:
+            lines.append("%-28s %10.1f %12.3f %12.3f" % (name, calls / float(count), total / count, own / count))
+        lines.append("")
+        lines.append("%-28s %10s %12s" % ("canvas primitive", "calls", "total ms"))
+        for name, calls, total in self.primitive_totals()[:top]:
+            lines.append("%-28s %10.1f %12.3f" % (name, calls / float(count), total / count))
+        lines.append("")
+        lines.append("%-28s %10s" % ("backend function", "calls"))
+        for name, calls in self.ffi_totals()[:top]:
+            lines.append("%-28s %10.1f" % (name, calls / float(count)))
+        return "\n".join(lines)
+
+
+class ProfilerOverlay (LayoutNode):
+    """ A widget that shows the frame rate and frame time percentiles of a Profiler, and the widget classes
+        that took the most time to render, slowest first.
+    """
+    def __init__ (self, profiler, top=5, width=48, **style):
+        self.style = CanvasStyle(**style)
+        self.profiler = profiler
+        self.top = top
+        self._w = width
+
+    def _measure (self): return (self._w, self.top + 2)
+
+    def lines (self):
+        profiler = self.profiler
+        times = profiler.frame_times()
+        lines = ["%.1f fps  p50 %.1f  p90 %.1f  p99 %.1f ms" %
+                 (profiler.fps(), percentile(times, 50), percentile(times, 90), percentile(times, 99))]
+        count = max(len(profiler.frames), 1)
+        lines.append("%-24s %8s %8s" % ("widget", "calls", "self ms"))
+        for name, calls, total, own in profiler.widget_totals()[:self.top]:
+            lines.append("%-24s %8.1f %8.2f" % (name[:24], calls / float(count), own / count))
+        return lines
+
+    @culled
+    def render (self, canvas, x, y):
+        with CanvasState(canvas, x, y):
+            self.style.apply(canvas)
+            lines = self.lines()
+            for i in range(self.top + 2):
+                line = lines[i] if i < len(lines) else ""
+                canvas.printstr(0, i, line[:self._w].ljust(self._w))
@@ -1,43 +1,55 @@
 from canvas import CanvasState, CanvasStyle
-import libtcodpy as dlib
+from backend import dlib
+from misc import Rectangle
+from widget import LayoutNode, culled
 
-class RectangleShape(object):
+class RectangleShape(LayoutNode):
+    simple = True
+    
     def __init__(self, width, height, char=None, **style):
         self.style = CanvasStyle(**style)
         self._w = width
         self._h = height
         self.char = char
         
-    def width (self): return self._w
-    def set_width (self, w): self._w = w   
-    def height (self): return self._h
-    def set_height (self, h): self._h = h
+    def _measure (self): return (self._w, self._h)
+    
+    @property
+    def opaque(self): return self.style.sets_background()
     
+    def set_width (self, w): 
+        self._w = w
+        self.invalidate_layout()
+    def set_height (self, h): 
+        self._h = h
+        self.invalidate_layout()
+    
+    @culled
     def render(self, canvas, x, y):
         with CanvasState(canvas,x,y):
             self.style.apply(canvas)
-            for i in range(self._w):
-                for j in range (self._h):
-                    canvas.put_char(i,j,self.char)
+            canvas.fill(Rectangle(0, 0, self._w, self._h), self.char)
 
 
 #OvalShape
 
-class Cell(object):
+class Cell(LayoutNode):
+    simple = True
+    
     def __init__(self, char, **style):
         self.style = CanvasStyle(**style)
         self.char = char
         
-    def width (self): return 1
-    def height (self): return 1
+    def _measure (self): return (1, 1)
     
+    @culled
     def render(self,canvas,x,y):
         with CanvasState(canvas,x,y):
             self.style.apply(canvas)
             canvas.put_char(0,0,self.char)
                 
 
-class CellArray(object):
+class CellArray(LayoutNode):
     def __init__(self, width, height, content, bg_char=" ", **style):
         """ Content must be a sequence of single characters or None values of length equal to width * height.
             For each item that is None the corresponding cell will not be rendered.
@@ -58,15 +70,17 @@ class CellArray(object):
         if len(self.content) != width * height:
             raise ValueError("length of given content does not match the size of the CellArray")
         
-    def width (self): return self._w
-    def height (self): return self._h
+    def _measure (self): return (self._w, self._h)
     
+    @culled
     def render(self, canvas, x, y):
-        width = self.width()
+        """ Only the cells that can be seen on the canvas are drawn."""
+        width = self._w
         with CanvasState(canvas, x, y):
             self.style.apply(canvas)
-            for i in range(self._w):
-                for j in range (self._h):
+            visible = canvas.visible_rect()
+            for j in range(max(visible.y, 0), min(visible.y + visible.height, self._h)):
+                for i in range(max(visible.x, 0), min(visible.x + visible.width, self._w)):
                     idx = i + j*width
                     char = self.content[idx]
                     if char is not None and char != self.bg_char:
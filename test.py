@@ -3,7 +3,7 @@ if __name__ == "__main__":
     import sys
     import console
     from widget import *
-    #from layouts import *
+    from layouts import *
     from textwidgets import *
     from shapes import *
     from decorators import *
@@ -22,7 +22,7 @@ if __name__ == "__main__":
     #console.set_fullscreen(True)
     root = console.canvas()
     
-    #panel = AbsoluteLayout()
+    panel = AbsoluteLayout()
     
     label1 = Label("Here is some text") >> Padding(top=5) >> Border(double_line, fg_colour=white) >> Fill(bg_colour=dark_blue)
     label2 = Label("This is a really long string of text.") >> Padding(hpad=3, vpad=2) >> Border(double_line, fg_colour=yellow) >> Fill(bg_colour=dark_red)
@@ -31,20 +31,16 @@ if __name__ == "__main__":
     
     #label4 = Label("This is a really long string of text.") >> Padding(hpad=3, vpad=2) >> Border(double_line, fg_colour=yellow) >> Fill(bg_colour=dark_red)
     
-    label1.render(root, 30, 9)
-    label2.render(root, 40, 15)
-    label3.render(root, 30, 4)
-    label4.render(root, 10, 25)
-    #panel.add(label1, 30, 9, zlevel=2)
-    #panel.add(label2, 40, 15, halign="left", zlevel=3)
-    #panel.add(label3, 30, 4, zlevel=1, halign="right")
-    #panel.add(label4, 10, 25, halign="left", zlevel=4)
+    panel.add(label1, 30, 9, zlevel=2)
+    panel.add(label2, 40, 15, halign="left", zlevel=3)
+    panel.add(label3, 30, 4, zlevel=1, halign="right")
+    panel.add(label4, 10, 25, halign="left", zlevel=4)
     
     bg = RectangleShape(console.width(),console.height(), char="/", fg_colour=dark_grey, bg_colour=darkest_red)
-    #panel.add(bg, 0, 0, zlevel=-100)
+    panel.add(bg, 0, 0, zlevel=-100)
     
     #bg.render(root,0,0)
-    #panel.render(root, 0,0)
+    panel.render(root, 0,0)
     
     #key_input.check_for_input()
     
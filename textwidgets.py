@@ -1,38 +1,137 @@
+import re
+
+from backend import dlib
 from canvas import CanvasState, CanvasStyle
-from decorators import Anchor
+from colour import parse_markup
 from misc import Rectangle
+from widget import LayoutNode, culled
+
+_NONSPACE = (re.compile(r"\S"), re.compile(r"\S", re.UNICODE))
+_chunk_patterns = {}
 
-class Label(object):
-    """A widget that displays a single line of text."""
+def _chunk_patterns_for (nbsp, is_unicode):
+    """ Returns a pair of compiled patterns that match the end of a chunk - whitespace that follows non-whitespace.
+        The first finds the next chunk end, the second, used with match(), the last chunk end before endpos.
+        nbsp is never considered whitespace.
+    """
+    key = (nbsp, is_unicode)
+    patterns = _chunk_patterns.get(key)
+    if patterns is None:
+        if nbsp:
+            space, nonspace = r"[^\S%s]" % re.escape(nbsp), r"[\S%s]" % re.escape(nbsp)
+        else:
+            space, nonspace = r"\s", r"\S"
+        flags = re.UNICODE if is_unicode else 0
+        patterns = (re.compile(r"(?<=%s)%s" % (nonspace, space), flags), 
+                    re.compile(r".*(?<=%s)%s" % (nonspace, space), flags | re.DOTALL))
+        _chunk_patterns[key] = patterns
+    return patterns
 
-    def __init__ (self,text, **style):       
+class Label(LayoutNode):
+    """ A widget that displays a single line of text.
+        If markup is True, the text may contain colour markup (see colour.TextColourParser). The text is then
+        drawn with one print for each run of colours. Text assigned later is parsed the same way, and reading
+        text gives it without the markup.
+    """
+
+    def __init__ (self,text, markup=False, **style):       
         self.style = CanvasStyle(**style)
+        self._markup = markup
+        self.runs = None        #(start, end, fg, bg) colour runs of the text, or None
         self.text = text
+    
+    @property
+    def text (self):
+        return self._text
+    
+    @text.setter
+    def text (self, value):
+        if self._markup:
+            self._text, self.runs = parse_markup(value)
+        else:
+            self._text, self.runs = value, None
        
-    def width (self): return len(self.text)
+    def _measure (self): return (len(self.text), 1)
     
-    def height (self): return 1
-               
+    @culled
     def render (self,canvas,x,y):
         with CanvasState(canvas,x,y):
             self.style.apply(canvas)
-            canvas.printstr(0,0,self.text)
+            _print_runs(canvas, 0, 0, self.text, self.runs)
 
-class Text (object):
+def _print_runs (canvas, x, y, text, runs):
+    """ Prints a line of text at x,y, with one print for each of its (start, end, fg, bg) colour runs if it has any."""
+    if not runs:
+        canvas.printstr(x, y, text)
+        return
+    
+    fg, bg, effect = canvas.fg_colour, canvas.bg_colour, canvas.bg_effect
+    for start, end, run_fg, run_bg in runs:
+        canvas.fg_colour = run_fg or fg
+        if run_bg is None:
+            canvas.bg_colour = bg
+            canvas.bg_effect = effect
+        else:
+            canvas.bg_colour = run_bg
+            canvas.bg_effect = dlib.BKGND_SET
+        canvas.printstr(x + start, y, text[start:end])
+    canvas.fg_colour, canvas.bg_colour, canvas.bg_effect = fg, bg, effect
+
+class Text (LayoutNode):
     """ A widget that displays a reflowable column of text. Always starts a new line at newline characters.
         If nbsp is a character, then that character will be used as non-breaking space.
+        If markup is True, the text may contain colour markup (see colour.TextColourParser). The colours
+        are kept across line breaks. Text given to append() is parsed on its own.
+        
+        The text is wrapped one paragraph (the text between two newlines) at a time, and the wrapped lines 
+        of each paragraph are cached, so assigning new text only re-wraps the paragraphs that changed.
+        append() re-wraps only the last paragraph and the appended text.
+        
+        Each line is kept as a (text, runs) tuple rather than a widget, so building a Text costs little more 
+        than wrapping it, and render() prints only the lines that can be seen.
     """
-    def __init__(self, text, max_width, text_align="left", nbsp=None, **style):
+    def __init__(self, text, max_width, text_align="left", nbsp=None, markup=False, **style):
         self.style = CanvasStyle(**style)
-        if max_width <= 0: raise ValueError("max_width must be greater than 0")
         
-        self.max_width = max_width
+        self._nbsp = nbsp
+        self._markup = markup
         self.text_align = text_align
-        self.nbsp = nbsp
-        self._lines = []    #A list of Label objects - one for each line
+        self._lines = []        #A list of (text, runs) for each line, where runs are the colour runs of the line or None
+        self._paragraphs = []   #A list of (paragraph, first, runs, lines) for each paragraph of the text
+        self._tail = 0          #index in _lines of the first line of the last paragraph
+        self._line_width = 0    #the length of the longest line
         
+        self.max_width = max_width
         self.text = text
         
+    @property
+    def max_width (self):
+        return self._max_width
+    
+    @max_width.setter
+    def max_width (self, value):
+        if value <= 0: raise ValueError("max_width must be greater than 0")
+        self._max_width = value
+        self._reflow()
+    
+    @property
+    def nbsp (self):
+        return self._nbsp
+    
+    @nbsp.setter
+    def nbsp (self, value):
+        self._nbsp = value
+        self._reflow()
+        
+    @property
+    def markup (self):
+        return self._markup
+    
+    @markup.setter
+    def markup (self, value):
+        self._markup = value
+        self._reflow()
+        
     @property
     def text (self):
         return self._text
@@ -40,69 +139,186 @@ class Text (object):
     @text.setter
     def text (self, value):
         self._text = value
-        if self.nbsp: 
-            self._lines = [Label(text.replace(self.nbsp, " ")) for text in self._get_line_text()] #make sure to replace nbsp characters with spaces
-        else:
-            self._lines = [Label(text) for text in self._get_line_text()] #generate lines from text flow
+        cache = dict(((par, first, runs), lines) for par, first, runs, lines in self._paragraphs)
+        self._paragraphs = []
+        self._lines = []
+        self._tail = 0
+        self._add_paragraphs(self._split_paragraphs(value), cache)
+        self._line_width = max([len(line[0]) for line in self._lines] or [0])
     
-    def _is_space(self, c):
-        """ Returns True if c should be considered whitespace. """
-        if c == self.nbsp:
-            return False
-        return c.isspace()
+    def append (self, text):
+        """ Adds text to the end of the current text. Only the last paragraph and the new text are re-wrapped."""
+        self._text += text
+        pars = self._split_paragraphs(text)
+        last, first, last_runs, lines = self._paragraphs.pop()
+        par, runs = pars[0]
+        pars[0] = (last + par, last_runs + tuple((start + len(last), end + len(last), fg, bg) for start, end, fg, bg in runs))
+        removed = self._lines[self._tail:]
+        del self._lines[self._tail:]
         
-    def _is_newline(self, c):
-        """ Returns True if c should be considered to start a new line. """
-        return c == "\n"
+        start = len(self._lines)
+        self._add_paragraphs(pars, {})
+        if max([len(line[0]) for line in removed] or [0]) < self._line_width:
+            self._line_width = max([self._line_width] + [len(line[0]) for line in self._lines[start:]])
+        else:
+            self._line_width = max([len(line[0]) for line in self._lines] or [0])
+        self.invalidate_layout()
+    
+    def _reflow (self):
+        #discard all cached paragraphs, since they were wrapped with a different max_width or nbsp
+        if hasattr(self, "_text"):
+            self._paragraphs = []
+            self.text = self._text
     
-    def _split(self, text):
-        """ Returns an iterator that breaks text into chunks consisting of a continuous block of non-whitespace followed by a
-            continouse block of whitespace.
+    def _split_paragraphs (self, text):
+        """ Returns a list of (paragraph, runs) for the paragraphs of text, where runs are the colour runs 
+            of the paragraph, relative to its start.
         """
-        if len(text) == 0:
-            return
+        if not self.markup:
+            return [(par, ()) for par in text.split("\n")]
+        
+        text, runs = parse_markup(text)
+        result = []
+        start = 0
+        i = 0       #index of the first run that is not before the paragraph
+        for par in text.split("\n"):
+            end = start + len(par)
+            par_runs = []
+            j = i
+            while j < len(runs) and runs[j][0] < end:
+                run_start, run_end, fg, bg = runs[j]
+                par_runs.append((max(run_start, start) - start, min(run_end, end) - start, fg, bg))
+                j += 1
+            result.append((par, tuple(par_runs)))
+            
+            start = end + 1     #skip the newline
+            while i < len(runs) and runs[i][1] <= start:
+                i += 1
+        return result
+    
+    def _add_paragraphs (self, pars, cache):
+        """ Wraps the given (paragraph, runs) and appends their lines, reusing the lines in cache when possible."""
+        for i, (par, runs) in enumerate(pars):
+            first = len(self._paragraphs) == 0
+            lines = cache.get((par, first, runs))
+            if lines is None:
+                lines = self._make_lines(par, first, runs)
+            self._paragraphs.append((par, first, runs, lines))
             
-        is_last_space = False   #was the last character whitespace?
-        i = 0                   #beginning of chunk index
-        for j in range(len(text)):
-            is_space = self._is_space(text[j])
-            if (is_space and not is_last_space) or self._is_newline(text[j]):
-                yield text[i:j]
-                i = j       #begin a new chunk
-            is_last_space = is_space
-        yield text[i:]
-    
-    def _get_line_text(self):
-        line = ""
-        for chunk in self._split(self.text):
-            if len(chunk) > 0 and self._is_newline(chunk[0]):         #break on newlines
-                yield line
-                line = chunk.lstrip()
-            elif len(line) + len(chunk) > self.max_width:   #break if the next chunk does not fit
-                yield line
-                line = chunk.lstrip()
+            self._tail = len(self._lines)
+            if i == len(pars) - 1 and len(lines[-1][0]) == 0:
+                self._lines.extend(lines[:-1])  #a trailing empty line of the text is not shown
             else:
-                line += chunk
-
-            while len(line) > self.max_width:   #break chunks that are larger than max_width
-                yield line[:self.max_width]
-                line = line[self.max_width:]
+                self._lines.extend(lines)
+    
+    def _make_lines (self, par, first, runs):
+        """ Returns (text, runs) for each wrapped line of a paragraph, with the colour runs that fall on that line."""
+        spans = self._wrap_spans(par, first)
+        if self.nbsp:
+            par = par.replace(self.nbsp, " ")   #make sure to replace nbsp characters with spaces
+        if not runs:
+            return [(par[start:end], None) for start, end in spans]
+        
+        lines = []
+        i = 0       #index of the first run that is not before the line
+        for start, end in spans:
+            while i < len(runs) and runs[i][1] <= start:
+                i += 1
+            line_runs = []
+            j = i
+            while j < len(runs) and runs[j][0] < end:
+                run_start, run_end, fg, bg = runs[j]
+                line_runs.append((max(run_start, start) - start, min(run_end, end) - start, fg, bg))
+                j += 1
+            lines.append((par[start:end], tuple(line_runs)))
+        return lines
+    
+    def _wrap_paragraph(self, par, first):
+        """ Returns the lines of a paragraph that contains no newlines, including the last line even if it is empty.
+            Leading whitespace is only kept for the first paragraph of the text.
+        """
+        return [par[start:end] for start, end in self._wrap_spans(par, first)]
+    
+    def _wrap_spans(self, par, first):
+        """ Returns the lines of a paragraph as a list of (start, end) slice indices into par.
         
-        if len(line) > 0:
-            yield line
+            A chunk is a continuous block of whitespace followed by a continuous block of non-whitespace, and
+            a line is broken before the first chunk that does not fit. Rather than walking the paragraph one
+            chunk at a time, each line is extended in one regex match to the last chunk end that fits, so the
+            Python level work is a few steps per line, and the scanning is done by the regex engine.
+        """
+        max_width = self.max_width
+        n = len(par)
+        is_unicode = isinstance(par, unicode)
+        next_end, last_end = _chunk_patterns_for(self.nbsp, is_unicode)
+        nonspace = _NONSPACE[is_unicode]
         
-    def width (self):
-        return max([line.width() for line in self._lines])
+        def chunk_end (pos):
+            match = next_end.search(par, pos + 1)
+            return match.start() if match else n
+        
+        start = 0
+        if not first:
+            start = n - len(par.lstrip())
+            if self.nbsp and self.nbsp.isspace():   #only the whitespace of the first chunk is dropped
+                start = min(start, chunk_end(0))
+        if n - start <= max_width:          #the whole paragraph fits on one line
+            return [(start, n)]
+        
+        spans = []
+        if first:
+            end = 0
+        else:
+            end = chunk_end(0)              #the line starts right after a newline, so its first chunk is always taken
+        
+        while True:
+            while end - start > max_width:  #break chunks that are larger than max_width
+                spans.append((start, start + max_width))
+                start += max_width
+            
+            if n - start <= max_width:      #the rest of the paragraph fits
+                end = n
+                break
+            match = last_end.match(par, end + 1, start + max_width + 1)  #take every following chunk that fits
+            if match:
+                end = match.end() - 1
+            
+            spans.append((start, end))      #break before the next chunk, and drop its leading whitespace
+            following = chunk_end(end)
+            match = nonspace.search(par, end, following)
+            start = match.start() if match else following
+            end = following
+        
+        spans.append((start, end))
+        return spans
+        
+    def _measure (self):
+        return (self._line_width, len(self._lines))
     
-    def height (self):
-        return len(self._lines)
+    def _line_x (self, text):
+        """ Returns the column of a line of text, which is aligned within max_width like with an Anchor."""
+        width = max(self.max_width, len(text))
+        if self.text_align == "left":
+            return 0
+        if self.text_align == "center":
+            return width/2 - len(text)/2
+        if self.text_align == "right":
+            return width - len(text)
+        raise ValueError("Unrecognized horizontal alignment: %s"%self.text_align)
     
     def render (self,canvas,x,y):
-        anchor = Anchor(halign=self.text_align, valign="top", min_width=self.max_width)
+        """ Only the lines that can be seen on the canvas are drawn."""
+        width = self._line_width
+        if self.text_align != "left":
+            width = max(width, self.max_width)  #aligned lines can be drawn right of the measured width
+        if not canvas.is_visible(x, y, width, len(self._lines)):
+            return
         with CanvasState(canvas,x,y):
             self.style.apply(canvas)
-            for i, line in enumerate(self._lines):
-                (line >> anchor).render(canvas,0,i)
+            visible = canvas.visible_rect()
+            for i in range(max(visible.y, 0), min(visible.y + visible.height, len(self._lines))):
+                text, runs = self._lines[i]
+                _print_runs(canvas, self._line_x(text), i, text, runs)
                 
                 
 ## Test Code
@@ -1,4 +1,6 @@
-import libtcodpy as dlib
+from collections import OrderedDict
+
+from backend import dlib
 import console
 from canvas import Canvas, CanvasState
 from events import EventSource
@@ -9,10 +11,24 @@ from shapes import *
 
 
 class Viewport (object):
-    """Allows for a scrollable view of a larger Canvas."""
-    def __init__(self, canvas, view_width, view_height):
+    """Allows for a scrollable view of a larger Canvas.
+        
+        If scroll_buffer is True, the view keeps the cells it last showed in a canvas of its own size that is 
+        used as a ring buffer. When the view has moved, the ring is rotated so the cells that are still visible 
+        stay where they are, and only the rows and columns that came into view are drawn into it, so following
+        a moving point costs O(perimeter) instead of O(area). A jump of a whole view or more redraws all of it.
+        
+        With scroll_buffer, cells that stay in view are not read from the world again, so changes to the world
+        canvas do not show until invalidate() is called. Call it after drawing on the world canvas.
+    """
+    def __init__(self, canvas, view_width, view_height, scroll_buffer=False):
         self.canvas = canvas
         self.viewport = Rectangle(0,0,view_width,view_height)
+        self.scroll_buffer = scroll_buffer
+        self._ring = None       #the scroll buffer canvas
+        self._ring_view = None  #the part of the world held by the scroll buffer
+        self._ring_x = 0        #the cell of the scroll buffer that holds the top left cell of _ring_view
+        self._ring_y = 0
     
     def to_screen_coord(self, x, y):
         """Converts canvas coordinates to screen coordinates."""
@@ -26,17 +42,21 @@ class Viewport (object):
         """Returns True if the parent coords x,y are inside the viewport."""
         return self.viewport.contains(x,y)
     
+    def world_width(self): return self.canvas.width
+    
+    def world_height(self): return self.canvas.height
+    
     def _limit_x(self, x):
         ## returns x so that it is a valid x-coordinate of the viewport
-        if x + self.viewport.width > self.canvas.width: 
-            x = self.canvas.width - self.viewport.width
+        if x + self.viewport.width > self.world_width(): 
+            x = self.world_width() - self.viewport.width
         if x < 0: x = 0
         return x
     
     def _limit_y(self, y):
         ## returns x so that it is a valid x-coordinate of the viewport
-        if y + self.viewport.height > self.canvas.height: 
-            y = self.canvas.height - self.viewport.height
+        if y + self.viewport.height > self.world_height(): 
+            y = self.world_height() - self.viewport.height
         if y < 0: y = 0
         return y
         
@@ -44,15 +64,82 @@ class Viewport (object):
     
     def height(self): return self.viewport.height
     
+    def invalidate(self, rect=None):
+        """ Drops the contents of the scroll buffer, so it is redrawn on the next render.
+            With scroll_buffer, this must be called whenever the world changes, or the view keeps showing the
+            cells it already had.
+        """
+        self._ring_view = None
+    
+    def _render_world(self, canvas, x, y, rect):
+        """ Draws the part rect of the world on canvas at x,y, given in absolute coordinates."""
+        self.canvas.blit_to(canvas, x, y, rect)
+    
     def render(self, canvas, x, y):
-        self.canvas.blit_to(canvas, x, y, self.viewport)
+        x += canvas.x_offset
+        y += canvas.y_offset
+        if not self.scroll_buffer:
+            self._render_world(canvas, x, y, self.viewport)
+            return
+        
+        self._update_ring()
+        #the ring is rotated, so the view is in up to four pieces split at the ring origin
+        view, ring = self.viewport, self._ring
+        for rx, tx, w in ((self._ring_x, 0, view.width - self._ring_x), (0, view.width - self._ring_x, self._ring_x)):
+            for ry, ty, h in ((self._ring_y, 0, view.height - self._ring_y), (0, view.height - self._ring_y, self._ring_y)):
+                if w > 0 and h > 0:
+                    ring.blit_to(canvas, x + tx, y + ty, Rectangle(rx, ry, w, h))
+    
+    def _update_ring(self):
+        """ Brings the scroll buffer up to date with the viewport."""
+        view, old = self.viewport, self._ring_view
+        if self._ring is None or (self._ring.width, self._ring.height) != (view.width, view.height):
+            self._ring = Canvas(view.width, view.height, buffered=True)
+            old = None
+        
+        dx = dy = 0
+        if old is not None:
+            dx, dy = view.x - old.x, view.y - old.y
+        if old is None or abs(dx) >= view.width or abs(dy) >= view.height:
+            self._ring_x = self._ring_y = 0
+            self._ring_view = Rectangle(view.x, view.y, view.width, view.height)
+            self._render_world(self._ring, 0, 0, self._ring_view)
+            return
+        if dx == 0 and dy == 0:
+            return
         
+        self._ring_x = (self._ring_x + dx) % view.width
+        self._ring_y = (self._ring_y + dy) % view.height
+        self._ring_view = Rectangle(view.x, view.y, view.width, view.height)
+        #the columns that came into view, then the rows that came into view without the corner they share
+        if dx:
+            cols = Rectangle(view.x + view.width - dx if dx > 0 else view.x, view.y, abs(dx), view.height)
+            self._render_ring(cols)
+        if dy:
+            rows = Rectangle(view.x, view.y + view.height - dy if dy > 0 else view.y, view.width, abs(dy))
+            if dx > 0: rows.width -= dx
+            elif dx < 0: rows.x, rows.width = rows.x - dx, rows.width + dx
+            if rows.width > 0:
+                self._render_ring(rows)
+    
+    def _render_ring(self, rect):
+        """ Draws the part rect of the world, which must be inside the viewport, in its cells of the scroll buffer."""
+        view = self.viewport
+        rx = (self._ring_x + rect.x - view.x) % view.width
+        ry = (self._ring_y + rect.y - view.y) % view.height
+        #split where the rect wraps around the edges of the ring
+        for x, w in ((rx, min(rect.width, view.width - rx)), (0, rect.width - (view.width - rx))):
+            for y, h in ((ry, min(rect.height, view.height - ry)), (0, rect.height - (view.height - ry))):
+                if w > 0 and h > 0:
+                    self._render_world(self._ring, x, y, 
+                        Rectangle(rect.x + (x - rx) % view.width, rect.y + (y - ry) % view.height, w, h))
+    
     def scroll_up(self):
         if self.viewport.y > 0: 
             self.viewport.y -= 1
     
     def scroll_down(self):
-        if self.viewport.y + self.viewport.height < self.canvas.height: 
+        if self.viewport.y + self.viewport.height < self.world_height(): 
             self.viewport.y += 1
             
     def scroll_left(self):
@@ -60,7 +147,7 @@ class Viewport (object):
             self.viewport.x -= 1
     
     def scroll_right(self):
-        if self.viewport.x + self.viewport.width < self.canvas.width: 
+        if self.viewport.x + self.viewport.width < self.world_width(): 
             self.viewport.x += 1
     
     def set_viewport(self,x,y):
@@ -72,3 +159,61 @@ class Viewport (object):
         self.viewport.x = self._limit_x(x - self.viewport.width/2)
         self.viewport.y = self._limit_y(y - self.viewport.height/2)
 
+
+class VirtualViewport (Viewport):
+    """ A scrollable view of a widget that can be much larger than the view, such as a world map.
+        
+        Instead of rendering the whole widget into a backing canvas, the world is divided into tiles of 
+        tile_width x tile_height cells, and only the tiles that intersect the viewport are rendered, each into 
+        its own buffered canvas. The widget is rendered into a tile at an offset, so a widget that only draws 
+        what is visible on the canvas (see widget.culled) only draws the cells of the tile.
+        
+        The canvases of the max_tiles most recently visible tiles are kept, so scrolling only renders the tiles 
+        that come into view. Call invalidate() when the content changes.
+    """
+    def __init__(self, content, view_width, view_height, tile_width=32, tile_height=16, max_tiles=64, 
+                 scroll_buffer=False):
+        Viewport.__init__(self, None, view_width, view_height, scroll_buffer)
+        self.content = content
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.max_tiles = max_tiles
+        self.tiles_rendered = 0     #number of tiles rendered since the viewport was created
+        self._tiles = OrderedDict() #maps (column, row) of each cached tile to its canvas, least recently used first
+    
+    def world_width(self): return self.content.width()
+    
+    def world_height(self): return self.content.height()
+    
+    def invalidate(self, rect=None):
+        """ Discards the cached tiles that intersect rect, given in world coordinates, or every tile."""
+        Viewport.invalidate(self, rect)
+        if rect is None:
+            self._tiles.clear()
+            return
+        for col, row in list(self._tiles):
+            if rect.intersection(Rectangle(col * self.tile_width, row * self.tile_height, self.tile_width, self.tile_height)):
+                del self._tiles[col, row]
+    
+    def _tile(self, col, row):
+        """ Returns the canvas of a tile, rendering it if it is not cached."""
+        key = (col, row)
+        tile = self._tiles.pop(key, None)
+        if tile is None:
+            tile = Canvas(self.tile_width, self.tile_height, buffered=True)
+            self.content.render(tile, -col * self.tile_width, -row * self.tile_height)
+            self.tiles_rendered += 1
+        self._tiles[key] = tile     #most recently used
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+    
+    def _render_world(self, canvas, x, y, rect):
+        tw, th = self.tile_width, self.tile_height
+        for row in range(rect.y // th, (rect.y + rect.height - 1) // th + 1):
+            for col in range(rect.x // tw, (rect.x + rect.width - 1) // tw + 1):
+                part = rect.intersection(Rectangle(col * tw, row * th, tw, th))
+                if part is None:
+                    continue
+                self._tile(col, row).blit_to(canvas, x + part.x - rect.x, y + part.y - rect.y,
+                    Rectangle(part.x - col * tw, part.y - row * th, part.width, part.height))
@@ -1,7 +1,177 @@
-import libtcodpy as dlib
+import functools
+import weakref
+from backend import dlib
 from canvas import Canvas, CanvasState, CanvasStyle
 from misc import Rectangle
 
+
+def measure(widget):
+    """ Returns a tuple (width, height) for any widget, using the memoized size if the widget has one."""
+    if isinstance(widget, LayoutNode):
+        return widget.measure()
+    return widget.width(), widget.height()
+
+def culled(render):
+    """ Decorates the render() method of a LayoutNode, so that it returns without doing anything when the 
+        bounding box of the node at x,y can not be seen - when it is outside of the canvas or its clip rectangle.
+    """
+    @functools.wraps(render)
+    def culled_render(self, canvas, x, y):
+        w, h = self.measure()
+        if canvas.is_visible(x, y, w, h):
+            render(self, canvas, x, y)
+    return culled_render
+
+class LayoutNode (object):
+    """ Base class for widgets that memoize their size.
+        Subclasses implement _measure(), which returns a tuple (width, height). The result is kept until
+        invalidate_layout() is called, which happens automatically whenever a public attribute is assigned,
+        or a CanvasStyle held in a public attribute is changed.
+        A node also invalidates every node that contains it, so a container must register its children 
+        with _link_child(). A container with a child that is not a LayoutNode can not know when that child
+        changes, so it is marked volatile and measures itself every time.
+        
+        A node is opaque if its render() covers every cell of its bounding box with an opaque background,
+        so that anything drawn there before it is hidden. Layouts use this to skip drawing what is hidden.
+        A node is simple if its render() is one or two canvas calls and renders no other widget, so that
+        rendering it several times with different clip rectangles costs little.
+    """
+    _size = None
+    _volatile = False
+    _layout_parents = None
+    opaque = False
+    simple = False
+    
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != "_":
+            if isinstance(value, CanvasStyle):
+                value._add_owner(self)
+            self.invalidate_layout()
+    
+    def _measure(self):
+        """ Override in a subclass."""
+        return (0, 0)
+    
+    def measure(self):
+        """ Returns a tuple (width, height), only calling _measure() if the size is not memoized."""
+        size = self._size
+        if size is None:
+            size = self._measure()
+            if not self._volatile:
+                self._size = size
+        return size
+    
+    def width (self): return self.measure()[0]
+    
+    def height (self): return self.measure()[1]
+    
+    def invalidate_layout(self):
+        """ Discards the memoized size of this widget and of every widget that contains it."""
+        self._size = None
+        if self._layout_parents:
+            for parent in list(self._layout_parents):
+                parent.invalidate_layout()
+    
+    def _set_volatile(self):
+        if not self._volatile:
+            self._volatile = True
+            if self._layout_parents:
+                for parent in list(self._layout_parents):
+                    parent._set_volatile()
+    
+    def _link_child(self, child):
+        if isinstance(child, LayoutNode):
+            if child._layout_parents is None:
+                child._layout_parents = weakref.WeakSet()
+            child._layout_parents.add(self)
+            if child._volatile:
+                self._set_volatile()
+        else:
+            self._set_volatile()
+    
+    def _unlink_child(self, child):
+        if isinstance(child, LayoutNode) and child._layout_parents is not None:
+            child._layout_parents.discard(self)
+
+
+class LayoutList (list):
+    """ A list of child widgets that keeps the memoized layout of its owner up to date when it is changed."""
+    def __init__(self, owner, items=()):
+        list.__init__(self, items)
+        self._owner = owner
+        for item in self:
+            owner._link_child(item)
+    
+    def _added(self, items):
+        for item in items:
+            self._owner._link_child(item)
+        self._owner.invalidate_layout()
+    
+    def _removed(self, items):
+        for item in items:
+            if item not in self:
+                self._owner._unlink_child(item)
+        self._owner.invalidate_layout()
+    
+    def append(self, item):
+        list.append(self, item)
+        self._added([item])
+    
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        self._added(items)
+    
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+    
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self._added([item])
+    
+    def remove(self, item):
+        list.remove(self, item)
+        self._removed([item])
+    
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self._removed([item])
+        return item
+    
+    def __setitem__(self, index, value):
+        old = self[index]
+        if isinstance(index, slice):
+            value = list(value)
+        list.__setitem__(self, index, value)
+        if isinstance(index, slice):
+            self._removed(old)
+            self._added(value)
+        else:
+            self._removed([old])
+            self._added([value])
+    
+    def __delitem__(self, index):
+        old = self[index]
+        list.__delitem__(self, index)
+        self._removed(old if isinstance(index, slice) else [old])
+    
+    def __setslice__(self, i, j, values):
+        self.__setitem__(slice(i, j), list(values))
+    
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(i, j))
+    
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._owner.invalidate_layout()
+    
+    def reverse(self):
+        list.reverse(self)
+        self._owner.invalidate_layout()
+
+
 class Widget (object):
     """ A Widget is an object that handles drawing and appearance of UI Controls.
         The minimum requirement for a widget are width() and height() methods that